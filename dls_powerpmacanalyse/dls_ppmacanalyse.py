@@ -1,9 +1,21 @@
 import argparse
+import array
+import asyncio
+import collections
+import collections.abc
+import concurrent.futures
+import copy
 import difflib
+import gzip
+import hashlib
+import itertools
+import json
 import logging
 import os
+import queue
 import re
 import sys
+import threading
 import time
 
 import numpy as np
@@ -37,6 +49,17 @@ def connectDisconnect(func):
     return wrapped_func
 
 
+def openClosePipelinedChannel(func):
+    def wrapped_func(self, *args):
+        self.openPipelinedChannel()
+        try:
+            return func(self, *args)
+        finally:
+            self.closePipelinedChannel()
+
+    return wrapped_func
+
+
 def fileExists(file):
     return os.path.isfile(file)
 
@@ -94,6 +117,14 @@ def parseArgs():
             " ignored."
         ),
     )
+    parser.add_argument(
+        "--comparetokens",
+        action="store_true",
+        help=(
+            "With --compare, compare programs by their tokens rather than the\n"
+            "text of their listings, ignoring changes to spacing and case."
+        ),
+    )
     parser.add_argument(
         "-d",
         "--download",
@@ -137,6 +168,117 @@ def parseArgs():
         help=("Power Pmac password"),
     )
     parser.add_argument("-n", "--name", metavar="", nargs=1, help="Name of Power PMAC.")
+    parser.add_argument(
+        "--rangequeries",
+        action="store_true",
+        help=(
+            "Read runs of indices of a data structure in a single command using\n"
+            "the Power PMAC range syntax, e.g. Motor[0..31].JogSpeed. Implies\n"
+            "--extentsearch, so that no range runs past the last index."
+        ),
+    )
+    parser.add_argument(
+        "--extentsearch",
+        action="store_true",
+        help=(
+            "Find the largest index accepted by the Power PMAC with a binary\n"
+            "search before reading an indexed data structure. This only saves\n"
+            "commands with --rangequeries, which implies it. With batched\n"
+            "queries it adds round trips."
+        ),
+    )
+    parser.add_argument(
+        "--pipeline",
+        metavar="",
+        nargs=1,
+        type=int,
+        help=(
+            "Pipeline commands sent to the Power PMAC, keeping up to <window>\n"
+            "commands awaiting a reply on each gpascii session.\n"
+            "--pipeline <window>"
+        ),
+    )
+    parser.add_argument(
+        "--controllerdump",
+        action="store_true",
+        help=(
+            "Read active elements with a script run on the Power PMAC, and copy\n"
+            "them back in a single compressed file."
+        ),
+    )
+    parser.add_argument(
+        "--cachedir",
+        metavar="",
+        nargs=1,
+        help=(
+            "Directory in which to cache data that only depends on the Power\n"
+            "PMAC firmware and symbols tables, e.g. the catalog of valid data\n"
+            "structures, and the tokens of program listings between runs.\n"
+            "--cachedir <cache dir>"
+        ),
+    )
+    parser.add_argument(
+        "--adaptive",
+        metavar="",
+        nargs="?",
+        const="",
+        help=(
+            "With --backup, predict the indices of each data structure from the\n"
+            "active elements of a previous back-up of the same Power PMAC, and only\n"
+            "probe the gaps and ends of their runs for new elements. This only\n"
+            "saves commands when the Power PMAC has not changed much since. Has\n"
+            "no effect with --rangequeries.\n"
+            "--adaptive [<previous back-up dir>], defaults to the results dir."
+        ),
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help=(
+            "With --backup, write active elements to active/activeElements.txt\n"
+            "while they are being read, rather than holding them all in memory."
+        ),
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help=(
+            "Carry on reading active elements from the checkpoint left in the\n"
+            "results directory by an interrupted back-up or compare, rather than\n"
+            "reading every data structure again."
+        ),
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help=(
+            "With --backup, only work out which data structures and index ranges\n"
+            "would be read once the ignore file is applied, and write the plan\n"
+            "and the expected number of queries to readPlan.txt in the results\n"
+            "directory."
+        ),
+    )
+    parser.add_argument(
+        "--buildsymbolcache",
+        metavar="",
+        nargs=1,
+        help=(
+            "Build the compiled caches of the symbols tables in every copy of the\n"
+            "Power PMAC Database directory found under a directory, so that later\n"
+            "back-ups and compares load them in one read.\n"
+            "--buildsymbolcache <databases dir>"
+        ),
+    )
+    parser.add_argument(
+        "--channels",
+        metavar="",
+        nargs=1,
+        type=int,
+        help=(
+            "Number of gpascii sessions used to read active elements from a\n"
+            "Power PMAC in parallel.\n--channels <number of sessions>"
+        ),
+    )
     return parser.parse_args()
 
 
@@ -279,6 +421,89 @@ mount -o remount,ro /opt/ >> /tmp/recover.log 2>&1
 echo "Sync completed." >> /tmp/recover.log 2>&1
 """
 
+activeStateDumpCmds = r"""
+#!/bin/bash
+
+# Read the active elements of the data structures listed in structures.txt using a
+# local gpascii session, and write them to activeElements.txt.gz. Each line of
+# structures.txt holds a data structure name followed by, for each of its [], the
+# number of indices to read (-1 to read until the Power PMAC rejects an index) and
+# the ranges of indices in the ignore list, e.g. 16:1-3,8-8.
+cd /tmp/ppmacdump
+if [[ $? -ne 0 ]] ; then
+    echo "Unable to cd into /tmp/ppmacdump. Exiting."
+    exit 1
+fi
+
+coproc GPASCII { gpascii -2 2>&1 ; }
+IN=${GPASCII[1]}
+OUT=${GPASCII[0]}
+
+# Wait for gpascii to start, then stop it echoing element names
+while IFS= read -r line <&$OUT ; do
+    [[ "$line" == *ASCII* ]] && break
+done
+echo "echo 7" >&$IN
+IFS= read -r -d $'\x06' reply <&$OUT
+
+query() {
+    echo "$1" >&$IN
+    IFS= read -r -d $'\x06' reply <&$OUT
+    reply=${reply//$'\r'/}
+    reply=${reply//$'\n'/}
+}
+
+# fill <element name> <limit:ignored ranges of each remaining index>...
+# Read all elements obtained by filling in the remaining [] of an element name,
+# and set 'accepted' to the number of elements accepted by the Power PMAC.
+fill() {
+    local name=$1 limit=${2%%:*} skip=${2#*:}
+    shift 2
+    local i=0 last=0 count=0 element range
+    while [[ $limit -lt 0 || $i -lt $limit ]] ; do
+        # Jump over ignored indices, which count as accepted when deciding when to
+        # stop
+        while [[ -n "$skip" ]] ; do
+            range=${skip%%,*}
+            [[ $i -lt ${range%-*} ]] && break
+            if [[ $i -le ${range#*-} ]] ; then
+                i=$((${range#*-} + 1))
+                last=$((i - 1))
+            fi
+            [[ "$skip" == *,* ]] && skip=${skip#*,} || skip=
+        done
+        [[ $limit -ge 0 && $i -ge $limit ]] && break
+        element=${name/\[\]/[$i]}
+        if [[ "$element" == *"[]"* ]] ; then
+            fill "$element" "$@"
+            count=$((count + accepted))
+            [[ $accepted -gt 0 ]] && last=$i
+            [[ $((i - last)) -gt 1 ]] && break
+        else
+            query "$element"
+            [[ "$reply" == *ILLEGAL* ]] && break
+            echo "$element $reply" >> activeElements.txt
+            count=$((count + 1))
+        fi
+        i=$((i + 1))
+    done
+    accepted=$count
+}
+
+: > activeElements.txt
+while read -r ds limits ; do
+    if [[ "$ds" == *"[]"* ]] ; then
+        fill "$ds" $limits
+    elif [[ -n "$ds" ]] ; then
+        query "$ds"
+        echo "$ds $reply" >> activeElements.txt
+    fi
+done < structures.txt
+
+exec {IN}>&-
+gzip -f activeElements.txt
+"""
+
 
 class PPMACLexer(object):
     # Tokens formed from the 'Power PMAC on-line commands' and
@@ -606,41 +831,107 @@ class PPMACLexer(object):
         ",",
     }
 
+    # Version of the tokens produced, to be increased whenever a change to the
+    # lexer changes them so that cached tokens are not used
+    version = 1
+    # Codes of the token types in packed tokens, see packTokens
+    packedTokenTypes = ("", "hex", "number", "string", "symbol")
+    packedTokenTypeCodes = {
+        tokenType: code for code, tokenType in enumerate(packedTokenTypes)
+    }
+    # Types of the tokens matched by tokenPattern
+    tokenTypes = {
+        "hex": "hex",
+        "number": "number",
+        "symbol": "symbol",
+        "nonAlphaNumeric": "",
+    }
+    # Pattern matching the next token, or for symbols and non-alphanumeric tokens
+    # the run of characters the token is the longest existing token at the start
+    # of. Symbols can contain indices, e.g. motor[1].jogspeed, and numbers stop
+    # before '..' used to indicate ranges.
+    tokenPattern = re.compile(
+        "(?P<space>[ \\n\\t\\r]+)"
+        "|(?P<hex>\\$[a-f0-9]*)"
+        "|(?P<string>'[^']*'|\"[^\"]*\")"
+        "|(?P<unterminatedString>['\"])"
+        "|(?P<number>[.0-9](?:[0-9]|\\.(?!\\.))*)"
+        "|(?P<symbol>[a-z](?:[a-z.]|\\[[0-9]*\\])*(?:\\[[0-9]*)?)"
+        f"|(?P<nonAlphaNumeric>[{re.escape(''.join(sorted(nonAlphaNumeric)))}]+)"
+    )
+
     class Chars(object):
+        """
+        Stream of the characters being lexed. The string is never modified, just
+        a cursor moved along it, so that peeking, moving and rewinding all take
+        constant time.
+        """
+
         def __init__(self, chars):
             self.chars = chars
-            self._chars = ""
+            self.position = 0
+            self.length = len(chars)
 
         def isEmpty(self):
-            if len(self.chars) == 0:
-                return True
-            else:
-                return False
+            return self.position >= self.length
 
         def peekNext(self):
-            return self.chars[1]
+            return self.chars[self.position + 1]
 
         def peek(self):
-            return self.chars[0]
+            return self.chars[self.position]
 
         def moveNext(self):
-            c = self.chars[0]
-            self._chars += self.chars[0]
-            self.chars = self.chars[1:]
+            c = self.chars[self.position]
+            self.position += 1
             return c
 
         def rewind(self, pos):
             if pos > 0:
-                self.chars = self._chars[-pos:] + self.chars
-                self._chars = self._chars[0:-pos]
+                self.position -= pos
 
-    def __init__(self, chars, extendedTokens={""}):
-        self.extendedTokens = {token.lower() for token in extendedTokens}
+    def __init__(self, chars, extendedTokens={""}, lowerCase=False):
+        if lowerCase:
+            # Already lower case, e.g. PowerPMAC.getDataStructureCatalog(), and
+            # shared between lexers, so it is not copied
+            self.extendedTokens = extendedTokens
+        else:
+            self.extendedTokens = {token.lower() for token in extendedTokens}
         self.tokens = []
         self.chars = self.Chars(chars.lower())
         for token in self.lex(self.chars):
             self.tokens.append(token)
 
+    @staticmethod
+    def packTokens(tokens):
+        """
+        Pack a list of tokens into a compact form that is quick to pass between
+        processes.
+        :param tokens: List of (type, value) tuples.
+        :return: Tuple of bytes of the token type codes and a string of the token
+        values separated by null characters.
+        """
+        return (
+            bytes(
+                PPMACLexer.packedTokenTypeCodes[tokenType] for tokenType, _ in tokens
+            ),
+            "\x00".join(value for _, value in tokens),
+        )
+
+    @staticmethod
+    def unpackTokens(packed):
+        """
+        Unpack tokens packed by packTokens.
+        :param packed: Tuple returned by packTokens.
+        :return: List of (type, value) tuples.
+        """
+        typeCodes, values = packed
+        tokenTypes = PPMACLexer.packedTokenTypes
+        return [
+            (tokenTypes[code], value)
+            for code, value in zip(typeCodes, values.split("\x00"))
+        ]
+
     def pop(self, n=0):
         token = self.tokens[n]
         self.tokens = self.tokens[n + 1 :]
@@ -656,123 +947,69 @@ class PPMACLexer(object):
         return "".join([token[1] for token in self.tokens])
 
     def lex(self, chars):
+        text = chars.chars
         while not chars.isEmpty():
-            c = chars.moveNext()
-            if c in PPMACLexer.spaces:
-                pass
-            elif c == "$":
-                yield ("hex", self.scanHexadecimal(c, chars))
-            elif c in ("'", '"'):
-                yield ("string", self.scanString(c, chars))
-            elif re.match("[.0-9]", c):
-                yield ("number", self.scanNumber(c, chars))
-            elif re.match("[a-zA-Z]", c):
-                yield ("symbol", self.scanSymbol(c, chars))
-            elif c in PPMACLexer.nonAlphaNumeric:
-                yield ("", self.scanNonAlphaNumeric(c, chars))
+            match = PPMACLexer.tokenPattern.match(text, chars.position)
+            if match is None:
+                raise IOError(f"Unknown token type {chars.peek()}")
+            kind = match.lastgroup
+            value = match.group()
+            if kind == "symbol":
+                value = self.matchSymbol(value, text[match.end() : match.end() + 1])
+            elif kind == "nonAlphaNumeric":
+                value = self.matchNonAlphaNumeric(value)
+            elif kind == "unterminatedString":
+                raise IOError(f"Unterminated string {text[chars.position :]}")
+            chars.position += len(value)
+            if kind == "string":
+                yield ("string", value[1:-1])
+            elif kind != "space":
+                yield (PPMACLexer.tokenTypes[kind], value)
+
+    def matchSymbol(self, run, nextChar):
+        """
+        Find the symbol token at the start of a run of symbol characters. This is
+        the longest existing token or extended token, e.g. an active element name,
+        that the run starts with, otherwise the whole run.
+        :param run: Characters matched by the symbol group of tokenPattern.
+        :param nextChar: Character following the run, or "" at the end.
+        :return: The token.
+        """
+        # Catch the few PPMACLexer.tokens that end in a digit, e.g. frax2
+        if len(run) > 1 and "0" <= nextChar <= "9":
+            if run + nextChar in PPMACLexer.tokens:
+                return run + nextChar
+        token = run[0] if run[0] in PPMACLexer.tokens else ""
+        # Build the name of each prefix with its indices replaced by [] as we go,
+        # to look it up in the extended tokens
+        name, index = run[0], ""
+        for end in range(1, len(run)):
+            c = run[end]
+            if c == "[":
+                index = c
+            elif index and c == "]":
+                name += "[]"
+                index = ""
+            elif index:
+                index += c
             else:
-                raise IOError(f"Unknown token type {c}")
-
-    def scanHexadecimal(self, c, chars):
-        ret = c
-        if chars.isEmpty():
-            return ret
-        next = chars.peek()
-        allowed = "[a-f0-9]"
-        while re.match(allowed, next) is not None:
-            ret += chars.moveNext()
-            if chars.isEmpty():
-                break
-            next = chars.peek()
-        return ret
-
-    def scanNonAlphaNumeric(self, c, chars):
-        ret = c
-        if chars.isEmpty():
-            return ret
-        existingToken = ""
-        if ret in PPMACLexer.tokens:
-            existingToken = ret
-        next = chars.peek()
-        allowed = PPMACLexer.nonAlphaNumeric
-        while next in allowed:
-            ret += chars.moveNext()
-            if ret in PPMACLexer.tokens:
-                existingToken = ret
-            if chars.isEmpty():
-                break
-        if len(existingToken) > 0:
-            chars.rewind(len(ret) - len(existingToken))
-            ret = existingToken
-        return ret
-
-    def scanSymbol(self, c, chars):
-        ret = c
-        if chars.isEmpty():
-            return ret
-        existingToken = ""
-        if ret in PPMACLexer.tokens:
-            existingToken = ret
-        next = chars.peek()
-        # if c in "PLQRCMDI" and next.isdigit():
-        #    # We have a P/L/Q/M/R/C variable
-        #    allowed = "[0-9]"
-        #    while re.match(allowed, next) != None:
-        #        ret += chars.moveNext()
-        #        if chars.isEmpty():
-        #            break
-        #        next = chars.peek()
-        # else:
-        if True:
-            # Check to see if we can find an existing token in the subsequent
-            # characters. If we do, take the longest existing token we find.
-            # If we don't, assume the token can take the form of an active element name.
-            allowed_ = "[a-zA-Z.\\[]"
-            # allowed_ = "[a-zA-Z0-9.\[]"
-            allowed = allowed_
-            while re.match(allowed, next) is not None:
-                if next == "[":
-                    allowed = "[0-9\\]]"
-                if next == "]":
-                    allowed = allowed_
-                ret += chars.moveNext()
-                if ret in PPMACLexer.tokens:
-                    existingToken = ret
-                # Use this condition to catch active element names
-                if re.sub("\\[([0-9]+)\\]", "[]", ret) in self.extendedTokens:
-                    existingToken = ret
-                if chars.isEmpty():
-                    break
-                # Use this condition to catch the few PPMACLexer.tokens that end
-                # in a digit, e.g. frax2
-                if (
-                    re.match("[0-9]", chars.peek())
-                    and ret + chars.peek() in PPMACLexer.tokens
-                ):
-                    existingToken = ret + chars.moveNext()
-                    break
-                next = chars.peek()
-            if len(existingToken) > 0:
-                chars.rewind(len(ret) - len(existingToken))
-                ret = existingToken
-        return ret
+                name += c
+            prefix = run[: end + 1]
+            if prefix in PPMACLexer.tokens or name + index in self.extendedTokens:
+                token = prefix
+        return token or run
 
-    def scanNumber(self, c, chars):
-        ret = c
-        if chars.isEmpty():
-            return ret
-        next = chars.peek()
-        allowed = "[.0-9]"
-        while re.match(allowed, next) is not None:
-            # to catch '..' used to indicate ranges
-            if next == ".":
-                if chars.peekNext() == ".":
-                    break
-            ret += chars.moveNext()
-            if chars.isEmpty():
-                break
-            next = chars.peek()
-        return ret
+    def matchNonAlphaNumeric(self, run):
+        """
+        Find the longest existing token at the start of a run of non-alphanumeric
+        characters, or the whole run if there is none.
+        :param run: Characters matched by the nonAlphaNumeric group of tokenPattern.
+        :return: The token.
+        """
+        for end in range(len(run), 0, -1):
+            if run[:end] in PPMACLexer.tokens:
+                return run[:end]
+        return run
 
     def scanMathsChars(self, c, chars):
         ret = c
@@ -785,16 +1022,25 @@ class PPMACLexer(object):
                 break
         return (self.mathsDict[ret], ret)
 
-    def scanString(self, delim, chars):
-        ret = ""
-        next = chars.peek()
-        while next != delim:
-            ret += chars.moveNext()
-            if chars.isEmpty():
-                break
-            next = chars.peek()
-        chars.moveNext()
-        return ret
+
+def lexInLexerProcess(listings, extendedTokens):
+    """
+    Lex a chunk of program listings in a process of the pool used by
+    PowerPMAC.lexPrograms. The data structure catalog is passed with each chunk
+    rather than once per process, so the pool needs no initializer.
+    :param listings: List of program listings.
+    :param extendedTokens: Lower case data structure catalog.
+    :return: List of the packed tokens of each listing, or None for a listing that
+    can not be lexed.
+    """
+    packedTokens = []
+    for listing in listings:
+        try:
+            tokens = PPMACLexer(listing, extendedTokens, lowerCase=True).tokens
+            packedTokens.append(PPMACLexer.packTokens(tokens))
+        except IOError:
+            packedTokens.append(None)
+    return packedTokens
 
 
 class PPMACProject(object):
@@ -944,10 +1190,12 @@ class PPMACCompare(object):
     Compare two PowerPMAC objects
     """
 
-    def __init__(self, ppmacA, ppmacB, compareDir):
+    def __init__(self, ppmacA, ppmacB, compareDir, compareTokens=False):
         self.ppmacInstanceA = ppmacA
         self.ppmacInstanceB = ppmacB
         self.compareDir = compareDir
+        # Compare programs by their tokens rather than the text of their listings
+        self.compareTokens = compareTokens
         # Set of element names only in A
         self.elemNamesOnlyInA = {}
         # Set of element names only in B
@@ -1032,9 +1280,20 @@ class PPMACCompare(object):
             for progName in self.progNamesOnlyInB:
                 writeFile.write(f">>>> {progName}\n")
                 writeFile.write(f"{programsB[progName].printInfo()}\n")
+        # Lex both sets of programs against the same data structures
+        catalog = self.ppmacInstanceA.getDataStructureCatalog().union(
+            self.ppmacInstanceB.getDataStructureCatalog()
+        )
         for progName in self.progNamesInAandB:
             filePath = f"{outputDir}/{progName}.diff"
             with open(filePath, "w+") as writeFile:
+                if self.compareTokens:
+                    writeFile.writelines(
+                        self.diffProgramTokens(
+                            programsA[progName], programsB[progName], catalog
+                        )
+                    )
+                    continue
                 writeFile.writelines(
                     difflib.unified_diff(
                         programsA[progName].listing,
@@ -1045,6 +1304,105 @@ class PPMACCompare(object):
                     )
                 )
 
+    def getProgramLineTokens(self, program, catalog):
+        """
+        Lex a program listing a line at a time, so that each token can be mapped
+        back to the line it is on. Lines the lexer can not handle are compared as
+        text, ignoring spacing and case.
+        :param program: PowerPMAC._Program instance.
+        :param catalog: Data structure catalog to lex the listing against.
+        :return: List of tuples of the tokens on each line of the listing.
+        """
+        lineTokens = []
+        for line in program.listing:
+            try:
+                lexer = PPMACLexer(line, catalog, lowerCase=True)
+                lineTokens.append(tuple(lexer.tokens))
+            except IOError:
+                text = "".join(line.split()).lower()
+                lineTokens.append((("line", text),) if text else ())
+        return lineTokens
+
+    @staticmethod
+    def getTokensHash(lineTokens):
+        digest = hashlib.sha256()
+        for tokenType, value in itertools.chain.from_iterable(lineTokens):
+            digest.update(f"{tokenType}\x00{value}\x00".encode())
+        return digest.digest()
+
+    @staticmethod
+    def getChangedLines(lineNumbers, start, end, lastLine):
+        """
+        Get the range of listing lines covering a range of tokens. For an empty
+        range of tokens this is the line they were inserted into, or an empty range
+        of lines where they were inserted between lines.
+        :param lineNumbers: List of the line each token is on.
+        :param start: Index of the first token.
+        :param end: Index of one past the last token.
+        :param lastLine: Line to use for tokens inserted after all the others.
+        :return: Tuple of the first line and one past the last line.
+        """
+        if start < end:
+            return lineNumbers[start], lineNumbers[end - 1] + 1
+        if start == len(lineNumbers):
+            return lastLine, lastLine
+        line = lineNumbers[start]
+        if start > 0 and lineNumbers[start - 1] == line:
+            return line, line + 1
+        return line, line
+
+    def diffProgramTokens(self, programA, programB, catalog):
+        """
+        Compare the tokens of two versions of a program, so that changes to only
+        the spacing, case or line breaks of its listing are ignored. The changes
+        are reported as the lines of the listings they are on, in unified diff
+        format. Lines are matched up first, then the tokens of the lines that
+        differ.
+        :param programA: PowerPMAC._Program instance from ppmacA.
+        :param programB: PowerPMAC._Program instance from ppmacB.
+        :param catalog: Data structure catalog to lex the listings against.
+        :return: Generator of the lines of the diff, none if the tokens are the same.
+        """
+        if programA.listing == programB.listing:
+            return
+        lineTokensA = self.getProgramLineTokens(programA, catalog)
+        lineTokensB = self.getProgramLineTokens(programB, catalog)
+        if self.getTokensHash(lineTokensA) == self.getTokensHash(lineTokensB):
+            return
+        hunks = []
+        lineMatcher = difflib.SequenceMatcher(None, lineTokensA, lineTokensB)
+        for tag, a1, a2, b1, b2 in lineMatcher.get_opcodes():
+            if tag == "equal":
+                continue
+            tokensA = list(itertools.chain.from_iterable(lineTokensA[a1:a2]))
+            tokensB = list(itertools.chain.from_iterable(lineTokensB[b1:b2]))
+            linesA = [a1 + n for n in range(a2 - a1) for _ in lineTokensA[a1 + n]]
+            linesB = [b1 + n for n in range(b2 - b1) for _ in lineTokensB[b1 + n]]
+            matcher = difflib.SequenceMatcher(None, tokensA, tokensB, autojunk=False)
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+                if tag == "equal":
+                    continue
+                startA, endA = self.getChangedLines(linesA, i1, i2, a2)
+                startB, endB = self.getChangedLines(linesB, j1, j2, b2)
+                # Merge changes to the same lines
+                if hunks and (startA < hunks[-1][1] or startB < hunks[-1][3]):
+                    lastStartA, lastEndA, lastStartB, lastEndB = hunks.pop()
+                    startA, endA = min(startA, lastStartA), max(endA, lastEndA)
+                    startB, endB = min(startB, lastStartB), max(endB, lastEndB)
+                hunks.append((startA, endA, startB, endB))
+        if len(hunks) == 0:
+            return
+        yield f"--- {self.ppmacInstanceA.source}: {programA.name}\n"
+        yield f"+++ {self.ppmacInstanceB.source}: {programB.name}\n"
+        for startA, endA, startB, endB in hunks:
+            rangeA = f"{startA + 1 if endA > startA else startA},{endA - startA}"
+            rangeB = f"{startB + 1 if endB > startB else startB},{endB - startB}"
+            yield f"@@ -{rangeA} +{rangeB} @@\n"
+            for line in programA.listing[startA:endA]:
+                yield "-" + line
+            for line in programB.listing[startB:endB]:
+                yield "+" + line
+
     def compareCoordSystemAxesDefinitions(self):
         outputDir = f"{self.compareDir}/active/axes"
         os.makedirs(outputDir, exist_ok=True)
@@ -1193,11 +1551,13 @@ class PPMACRepositoryWriteRead(object):
     def setRepositoryPath(self, path):
         self.repositoryPath = path
 
-    def writeActiveState(self):
+    def writeActiveState(self, includeActiveElements=True):
         os.makedirs(self.repositoryPath + "/active", exist_ok=True)
         self.writeDataStructures()
-        self.writeActiveElements()
+        if includeActiveElements:
+            self.writeActiveElements()
         self.writeAllPrograms()
+        self.writeProgramCrossReference()
         self.writeCSAxesDefinitions()
 
     def writeDataStructures(self):
@@ -1240,6 +1600,10 @@ class PPMACRepositoryWriteRead(object):
         self.writePrograms(self.ppmacInstance.forwardPrograms, progsDir)
         self.writePrograms(self.ppmacInstance.inversePrograms, progsDir)
 
+    def writeProgramCrossReference(self):
+        file = self.repositoryPath + "/active/programReferences.json"
+        self.ppmacInstance.getProgramCrossReference().write(file)
+
     def writeCSAxesDefinitions(self):
         csAxesDefsPath = self.repositoryPath + "/active/axes"
         os.makedirs(csAxesDefsPath, exist_ok=True)
@@ -1254,17 +1618,17 @@ class PPMACRepositoryWriteRead(object):
         fileName = self.repositoryPath + "/active/activeElements.txt"
         with open(fileName, "r") as readFile:
             for line in readFile:
-                line = line.split()
-                line = [item.strip() for item in line]
-                if line == "":
+                name, _, value = line.strip().partition(" ")
+                if name == "":
                     continue
-                key = line[0]
-                value = line[
-                    0:
-                ]  # need to deal with the list of indices which is tha last column(s)
-                self.ppmacInstance.activeElements[
-                    key
-                ] = self.ppmacInstance.ActiveElement(*value[0:5])
+                self.ppmacInstance.activeElements.add(name, value.strip())
+
+    def readAndStoreProgramCrossReference(self):
+        fileName = self.repositoryPath + "/active/programReferences.json"
+        # Not written by older versions
+        if fileExists(fileName):
+            self.ppmacInstance.programCrossReference = PPMACProgramCrossReference()
+            self.ppmacInstance.programCrossReference.read(fileName)
 
     def readAndStoreCSAxesDefinitions(self):
         csAxesDefsPath = self.repositoryPath + "/active/axes"
@@ -1354,29 +1718,457 @@ class PPMACRepositoryWriteRead(object):
                 )
 
 
+class PPMACIgnoreTrie(object):
+    """
+    Compiled form of an ignore file. Each data structure in the ignore file is
+    split into its '.' separated substructures, which form the path to a node in a
+    prefix trie. A substructure containing a spliced range of indices (e.g. the
+    IO[1:4095] of ECAT[].IO[1:4095]) is stored as a single interval rather than
+    being expanded into one name per index. All other substructures, including
+    open-ended ranges such as Coord[8:], only match the same text.
+    """
+
+    class Node(object):
+        def __init__(self):
+            # Maps substructures to child nodes
+            self.children = {}
+            # Maps substructure names to lists of (indices, child node) pairs, for
+            # substructures containing a spliced range of indices
+            self.splicedChildren = {}
+            # True if a data structure in the ignore file ends at this node
+            self.ignored = False
+
+    indexRegex = re.compile("0|[1-9][0-9]*")
+    splicedRegex = re.compile("([0-9]+):([0-9]+)")
+
+    def __init__(self, dataStructures=()):
+        self.root = self.Node()
+        self.dataStructures = []
+        for dataStructure in dataStructures:
+            self.add(dataStructure)
+
+    def __contains__(self, dataStructure):
+        return any(node.ignored for node in self.walk(dataStructure, stopEarly=False))
+
+    def __iter__(self):
+        return iter(self.dataStructures)
+
+    def __len__(self):
+        return len(self.dataStructures)
+
+    def splitSubstructure(self, substructure):
+        """
+        Split a substructure into its name and its indices, e.g. 'Data[][10:]'
+        gives ('Data', ['', '10:']).
+        :param substructure: String containing a substructure.
+        :return: Tuple of (name, list of index strings).
+        """
+        name, bracket, indices = substructure.partition("[")
+        if bracket == "" or not indices.endswith("]"):
+            return substructure, []
+        return name, indices[:-1].split("][")
+
+    def add(self, dataStructure):
+        """
+        Add a data structure from the ignore file to the trie.
+        :param dataStructure: String containing a data structure name, with at most
+        one spliced range of indices.
+        :return:
+        """
+        if dataStructure.count(":") > 1:
+            raise IOError(f"Too many spliced indices in {dataStructure}.")
+        node = self.root
+        for substructure in dataStructure.split("."):
+            name, indices = self.splitSubstructure(substructure)
+            spliced = [self.splicedRegex.fullmatch(index) for index in indices]
+            if not any(spliced):
+                node = node.children.setdefault(substructure, self.Node())
+                continue
+            indices = tuple(
+                (int(match.group(1)), int(match.group(2))) if match else index
+                for index, match in zip(indices, spliced)
+            )
+            siblings = node.splicedChildren.setdefault(name, [])
+            for siblingIndices, sibling in siblings:
+                if siblingIndices == indices:
+                    node = sibling
+                    break
+            else:
+                siblings.append((indices, self.Node()))
+                node = siblings[-1][1]
+        node.ignored = True
+        self.dataStructures.append(dataStructure)
+
+    def indicesMatch(self, splicedIndices, indices):
+        if len(splicedIndices) != len(indices):
+            return False
+        for splicedIndex, index in zip(splicedIndices, indices):
+            if isinstance(splicedIndex, tuple):
+                if not self.indexRegex.fullmatch(index):
+                    return False
+                if not splicedIndex[0] <= int(index) <= splicedIndex[1]:
+                    return False
+            elif splicedIndex != index:
+                return False
+        return True
+
+    def walk(self, dataStructure, stopEarly=True):
+        """
+        Walk down the trie following the substructures of a data structure.
+        :param dataStructure: String containing a data structure name.
+        :param stopEarly: If True, stop as soon as a node where an ignored data
+        structure ends is reached.
+        :return: List of the nodes matching the whole data structure, or containing
+        the first ignored node reached if stopEarly is True.
+        """
+        nodes = [self.root]
+        for substructure in dataStructure.split("."):
+            matches = []
+            for node in nodes:
+                if substructure in node.children:
+                    matches.append(node.children[substructure])
+                if node.splicedChildren:
+                    name, indices = self.splitSubstructure(substructure)
+                    for splicedIndices, child in node.splicedChildren.get(name, []):
+                        if self.indicesMatch(splicedIndices, indices):
+                            matches.append(child)
+            nodes = matches
+            if len(nodes) == 0 or (stopEarly and any(n.ignored for n in nodes)):
+                break
+        return nodes
+
+    def isIgnored(self, dataStructure):
+        """
+        Determine whether a data structure, or any of its parent, grandparent etc.
+        structures, is in the ignore file, in a single walk of the trie.
+        :param dataStructure: String containing a data structure name.
+        :return: True if the data structure should be ignored, False otherwise.
+        """
+        return any(node.ignored for node in self.walk(dataStructure))
+
+
+class PPMACReadPlan(object):
+    """
+    Plan of which data structures are read from a ppmac, and which index ranges are
+    read for each of them, once the ignore file has been taken into account.
+    """
+
+    def __init__(self):
+        # Un-indexed data structures to read
+        self.scalars = []
+        # Maps indexed data structures to read to lists holding, for each index,
+        # the lowest index not read (or None if it is only found by probing) and
+        # the number of indices read below it
+        self.indexed = {}
+        # Maps data structures that are not read at all to the reason why
+        self.skipped = {}
+        # Estimated number of gpascii commands sent to read the plan
+        self.queries = 0
+
+    def report(self):
+        """
+        Generate a human-readable description of the plan.
+        :return: String containing the description.
+        """
+        unbounded = [
+            ds
+            for ds, limits in self.indexed.items()
+            if any(limit is None for limit, _ in limits)
+        ]
+        lines = [
+            f"Un-indexed data structures read: {len(self.scalars)}",
+            f"Indexed data structures read: {len(self.indexed)}",
+            f"Data structures skipped: {len(self.skipped)}",
+            f"Indexed data structures with indices found by probing: "
+            f"{len(unbounded)}",
+            f"Estimated number of queries: {self.queries}",
+            "",
+        ]
+        for ds, limits in self.indexed.items():
+            ranges = [
+                "[0:]" if limit is None else f"[0:{limit - 1}] ({count} read)"
+                for limit, count in limits
+            ]
+            lines.append(f"read {ds} {' '.join(ranges)}")
+        for ds, reason in self.skipped.items():
+            lines.append(f"skip {ds} ({reason})")
+        return "\n".join(lines) + "\n"
+
+
+class PPMACActiveElementsWriter(object):
+    """
+    Thread writing active elements to an activeElements.txt file while they are
+    still being read from a ppmac. Elements are passed to it through a bounded
+    queue, so that if writing falls behind reading is held up rather than memory
+    use growing. The file is only put in place once it is complete.
+    """
+
+    def __init__(self, fileName, maxQueueSize=10000):
+        self.fileName = fileName
+        self.partFileName = f"{fileName}.part"
+        self.queue = queue.Queue(maxsize=maxQueueSize)
+        self.error = None
+        self.closed = False
+        self.elementsWritten = 0
+        os.makedirs(os.path.dirname(os.path.abspath(fileName)), exist_ok=True)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            with open(self.partFileName, "w+") as writeFile:
+                while True:
+                    element = self.queue.get()
+                    if element is None:
+                        return
+                    writeFile.write(PowerPMAC.ActiveElement(*element).printInfo())
+                    writeFile.write("\n")
+                    self.elementsWritten += 1
+        except IOError as e:
+            self.error = e
+            # Keep taking elements so that the reading threads are not blocked
+            while self.queue.get() is not None:
+                pass
+
+    def put(self, element):
+        """
+        Queue an active element to be written.
+        :param element: Tuple of the arguments of PowerPMAC.ActiveElement.
+        :return:
+        """
+        if self.error is not None:
+            raise self.error
+        self.queue.put(element)
+
+    def close(self, keep=True):
+        """
+        Wait for the queued elements to be written and close the file.
+        :param keep: If True, move the file into place, otherwise delete it.
+        :return:
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            keep = False
+        if keep:
+            os.replace(self.partFileName, self.fileName)
+            logging.info(
+                f"Wrote {self.elementsWritten} active elements to {self.fileName}."
+            )
+        elif fileExists(self.partFileName):
+            os.remove(self.partFileName)
+        if self.error is not None:
+            raise self.error
+
+
+class PPMACPipelinedChannel(object):
+    """
+    gpascii session on which several commands can be in flight at once. Commands are
+    written to the session ahead of the replies to earlier commands, like HTTP
+    pipelining, and each reply, terminated by an ACK character, is matched back to
+    its command in the order the commands were sent.
+    """
+
+    def __init__(self, sshInterface, window=32):
+        """
+        Open a gpascii session on the SSH connection of a connected
+        dls_pmacremote.PPmacSshInterface object.
+        :param sshInterface: Connected dls_pmacremote.PPmacSshInterface object.
+        :param window: Maximum number of commands awaiting a reply at any time.
+        """
+        self.window = max(1, window)
+        self.loop = asyncio.new_event_loop()
+        self.buffer = ""
+        # Futures of the commands awaiting a reply, oldest first
+        self.pending = collections.deque()
+        self.channel = sshInterface.client.get_transport().open_session()
+        # gpascii reports rejected commands on stderr, which would otherwise never
+        # be read and would stall the session once the SSH window filled up
+        self.channel.set_combine_stderr(True)
+        self.channel.exec_command("gpascii -2")
+        self.loop.run_until_complete(self.start())
+
+    async def start(self):
+        self.slots = asyncio.Semaphore(self.window)
+        self.opened = self.loop.create_future()
+        self.loop.add_reader(self.channel.fileno(), self.receive)
+        await self.opened
+        await self.query("echo 7")
+
+    def receive(self):
+        data = b""
+        while self.channel.recv_ready():
+            data += self.channel.recv(8192)
+        if data == b"" and self.channel.exit_status_ready():
+            self.loop.remove_reader(self.channel.fileno())
+            error = IOError("gpascii session closed by the Power PMAC.")
+            if not self.opened.done():
+                self.opened.set_exception(error)
+            while self.pending:
+                self.pending.popleft().set_exception(error)
+            return
+        self.buffer += data.decode(encoding="ISO-8859-1")
+        if not self.opened.done():
+            # Discard the banner printed when gpascii starts
+            if "ASCII" not in self.buffer:
+                return
+            self.buffer = self.buffer.split("ASCII", 1)[1].split("\n", 1)[-1]
+            self.opened.set_result(True)
+        while "\x06" in self.buffer and self.pending:
+            reply, self.buffer = self.buffer.split("\x06", 1)
+            lines = reply.replace("\r\n", "\r").replace("\n", "\r").strip("\r")
+            self.pending.popleft().set_result([] if lines == "" else lines.split("\r"))
+
+    async def query(self, cmd):
+        async with self.slots:
+            future = self.loop.create_future()
+            self.pending.append(future)
+            self.channel.sendall((cmd + "\n").encode(encoding="ISO-8859-1"))
+            return await future
+
+    async def queryAll(self, cmds):
+        return await asyncio.gather(*[self.query(cmd) for cmd in cmds])
+
+    def sendCommand(self, cmd):
+        """
+        Send a command and block until its reply is received.
+        :param cmd: Command string.
+        :return: List of the lines of the reply.
+        """
+        return self.loop.run_until_complete(self.query(cmd))
+
+    def sendCommands(self, cmds):
+        """
+        Send a list of commands, keeping up to window commands in flight, and
+        block until all replies are received.
+        :param cmds: List of command strings.
+        :return: List of replies in the same order as cmds, each a list of lines.
+        """
+        return self.loop.run_until_complete(self.queryAll(cmds))
+
+    def close(self):
+        self.loop.remove_reader(self.channel.fileno())
+        self.channel.close()
+        self.loop.close()
+
+
 class PPMACHardwareWriteRead(object):
-    def __init__(self, ppmac=None, tempDir=None):
+    # Variables holding the number of instances of top-level data structures
+    sysMaxVariables = {
+        "Motor": "Sys.MaxMotors",
+        "Coord": "Sys.MaxCoords",
+        "EncTable": "Sys.MaxEncoders",
+        "ECAT": "Sys.MaxEcats",
+    }
+    # Variables holding the number of enabled tables. The enabled tables need not
+    # be the lowest numbered ones, so these do not bound the indices
+    sysEnableVariables = {
+        "CompTable": "Sys.CompEnable",
+        "CamTable": "Sys.CamEnable",
+    }
+    # Format version of the compiled symbols table caches
+    symbolsTableCacheVersion = 1
+
+    def __init__(
+        self,
+        ppmac=None,
+        tempDir=None,
+        batchSize=32,
+        useRangeQueries=False,
+        useExtentSearch=False,
+        channels=1,
+        username=None,
+        password=None,
+        pipelineWindow=0,
+        useControllerDump=False,
+        cacheDir=None,
+        previousSnapshotDir=None,
+        resume=False,
+        streamFile=None,
+    ):
         self.ppmacInstance = ppmac
         # Set PPMAC source to hardware
         if self.ppmacInstance.source == "unknown":
             self.ppmacInstance.source = "hardware"
-        # Path to directory containing symbols tables files on local
-        if tempDir is not None:
-            self.local_db_path = tempDir
+        # Path to directory containing symbols tables files on local. None means no
+        # files are written locally.
+        self.local_db_path = tempDir
         # File containing list of all base Data Structures
         self.pp_swtbl0_txtfile = "pp_swtbl0.txt"
         # Standard Data Structure symbols tables
         self.pp_swtlbs_symfiles = ["pp_swtbl1.sym", "pp_swtbl2.sym", "pp_swtbl3.sym"]
-        # Read maximum values for the various configuration parameters
-        # self.readSysMaxes()
+        # Maximum number of element names queried in a single gpascii command
+        self.batchSize = max(1, batchSize)
+        # Maximum length of a gpascii command line holding a batch of queries
+        self.maxCommandLength = 255
+        # Read runs of indices with range queries, e.g. Motor[0..31].JogSpeed. The
+        # extent of each index is then always found before reading it
+        self.useRangeQueries = useRangeQueries
+        # Maximum number of indices requested in a single range query
+        self.rangeSize = 256
+        # Find the extent of each index with a binary search before reading it
+        self.useExtentSearch = useExtentSearch
+        # Largest index searched for when an index has no open-ended ignore range
+        self.maxIndexExtent = 2**20
+        # Open-ended ignore ranges found for each index of each data structure
+        self.openEndedIndexLimits = {}
+        self.openEndedIndexStarts = None
+        # Indices mentioned in the ignore list, which are the only ones that can be
+        # ignored individually
+        self.ignoredIndexCandidates = None
+        # Format templates used to fill in the indices of each data structure
+        self.indexTemplates = {}
+        # Back-up whose active elements are used to predict the indices of each
+        # data structure, and the indices read from it. None means every data
+        # structure is read by enumerating its indices.
+        self.previousSnapshotDir = previousSnapshotDir
+        self.previousIndices = {}
+        # File to which the active elements of each data structure are written as
+        # soon as it has been read, and whether to carry on from an existing one
+        self.checkpointFile = None
+        self.checkpointLock = threading.Lock()
+        self.resume = resume
+        # activeElements.txt file that active elements are written to while they
+        # are being read, rather than being kept in memory. None disables this.
+        self.streamFile = streamFile
+        self.activeElementsWriter = None
+        # Number of instances of top-level data structures, read from the ppmac
+        self.indexBounds = {}
+        # gpascii session used to talk to the ppmac. None means the module-level
+        # sshClient.
+        self.gpasciiClient = None
+        # Number of gpascii sessions used to read active elements in parallel, and
+        # the credentials used to open the additional sessions
+        self.channels = max(1, channels)
+        self.username = username
+        self.password = password
+        # Maximum number of commands in flight on a pipelined gpascii session. 0
+        # means commands are sent one at a time through gpasciiClient.
+        self.pipelineWindow = pipelineWindow
+        self.pipelinedChannel = None
+        # Read active elements with a script run on the ppmac itself
+        self.useControllerDump = useControllerDump
+        # Directory on the ppmac used by the script
+        self.remoteDumpDir = "/tmp/ppmacdump"
+        # Directory in which results that only depend on the firmware and symbols
+        # tables are cached between runs. None disables caching.
+        self.cacheDir = cacheDir
 
     def setPPMACInstance(self, ppmac):
         self.ppmacInstance = ppmac
         if self.ppmacInstance.source == "unknown":
             self.ppmacInstance.source = "hardware"
 
+    def getSshClient(self):
+        if self.gpasciiClient is None:
+            return sshClient
+        return self.gpasciiClient
+
     def getCommandReturnInt(self, cmd):
-        (cmdReturn, status) = sshClient.sendCommand(cmd)
+        (cmdReturn, status) = self.getSshClient().sendCommand(cmd)
         if status:
             cmdReturnInt = int(cmdReturn[0:])
         else:
@@ -1386,29 +2178,74 @@ class PPMACHardwareWriteRead(object):
         return cmdReturnInt
 
     def readSysMaxes(self):
+        """
+        Read the number of instances of the top-level data structures listed in
+        sysMaxVariables, and the number of enabled tables listed in
+        sysEnableVariables, from the ppmac in a single batch. The values are stored
+        in the ppmac object. The numbers of instances are also used as the bounds
+        of the first index of those data structures, so they can be read without
+        probing for their extent.
+        :return:
+        """
         if self.ppmacInstance is None:
             raise RuntimeError("No Power PMAC object has been specified")
+        variables = [*self.sysMaxVariables.items(), *self.sysEnableVariables.items()]
+        replies = self.sendCommandBatch([variable for _, variable in variables])
+        self.indexBounds = {}
+        enabledTables = {}
+        for (category, variable), reply in zip(variables, replies):
+            bounded = category in self.sysMaxVariables
+            try:
+                if bounded:
+                    self.indexBounds[category] = int(reply)
+                else:
+                    enabledTables[category] = int(reply)
+            except ValueError:
+                logging.info(
+                    f"Unable to read {variable}"
+                    + (f", {category}[] indices will be probed." if bounded else ".")
+                )
         # number of active motors
-        self.ppmacInstance.numberOfMotors = self.getCommandReturnInt("Sys.MaxMotors")
+        self.ppmacInstance.numberOfMotors = self.indexBounds.get("Motor")
         # number of active coordinate systems
-        self.ppmacInstance.numberOfCoordSystems = self.getCommandReturnInt(
-            "Sys.MaxCoords"
-        )
+        self.ppmacInstance.numberOfCoordSystems = self.indexBounds.get("Coord")
         # number of active compensation tables.
-        self.ppmacInstance.numberOfCompTables = self.getCommandReturnInt(
-            "Sys.CompEnable"
-        )
+        self.ppmacInstance.numberOfCompTables = enabledTables.get("CompTable")
         # number of active cam tables
-        self.ppmacInstance.numberOfCamTables = self.getCommandReturnInt("Sys.CamEnable")
+        self.ppmacInstance.numberOfCamTables = enabledTables.get("CamTable")
         # number EtherCAT networks that can be enabled
-        self.ppmacInstance.numberOfECATs = self.getCommandReturnInt("Sys.MaxEcats")
+        self.ppmacInstance.numberOfECATs = self.indexBounds.get("ECAT")
         # Number of available encoder tables
-        self.ppmacInstance.numberOfEncTables = self.getCommandReturnInt(
-            "Sys.MaxEncoders"
-        )
+        self.ppmacInstance.numberOfEncTables = self.indexBounds.get("EncTable")
+
+    def getIndexBound(self, dataStructure, dim):
+        """
+        Get the number of instances of a data structure's dim'th index read from
+        the Sys.Max* variables, if known. Only the index of a top-level data
+        structure, e.g. Motor[], is bounded in this way.
+        :param dataStructure: String containing the data structure name.
+        :param dim: Position of the index in the data structure name, starting at 1.
+        :return: Number of instances, or None if unknown.
+        """
+        if dim != 1 or not dataStructure.split(".", 1)[0].endswith("[]"):
+            return None
+        return self.indexBounds.get(self.getDataStructureCategory(dataStructure))
+
+    def openPipelinedChannel(self):
+        if self.pipelineWindow > 0 and self.pipelinedChannel is None:
+            self.pipelinedChannel = PPMACPipelinedChannel(
+                self.getSshClient(), self.pipelineWindow
+            )
+
+    def closePipelinedChannel(self):
+        if self.pipelinedChannel is not None:
+            self.pipelinedChannel.close()
+            self.pipelinedChannel = None
 
     def sendCommand(self, cmd):
-        (data, status) = sshClient.sendCommand(cmd)
+        if self.pipelinedChannel is not None:
+            return self.pipelinedChannel.sendCommand(cmd)
+        (data, status) = self.getSshClient().sendCommand(cmd)
         if not status:
             raise IOError(
                 "Cannot retrieve data structure: error communicating with PMAC"
@@ -1417,18 +2254,206 @@ class PPMACHardwareWriteRead(object):
             data = data.split("\r")[:-1]
         return data
 
-    def swtblFileToList(self, pp_swtbl_file):
+    def nextBatch(self, cmds, endsBatch=()):
         """
-        Generate a list of symbols from a symbols table file.
-        :param pp_swtbl_file: full path to symbols table file.
-        :return: swtbl_DSs: list of symbols, where each 'symbol' is represented by
-        the contents of one row of the symbols table file.
+        Take as many queries as fit on a single gpascii command line from the start
+        of a list of queries.
+        :param cmds: Non-empty list of queries.
+        :param endsBatch: Set of queries likely to be rejected by the ppmac. A batch
+        ends with the first of them, so that rejecting it abandons no other query.
+        :return: List of the queries in the batch.
         """
-        symbols = []
-        try:
-            file = open(file=pp_swtbl_file, mode="r", encoding="ISO-8859-1")
-            multi_line = ""
-            for line in file:
+        batch = [cmds[0]]
+        length = len(cmds[0])
+        for cmd in cmds[1 : self.batchSize]:
+            length += len(cmd) + 1
+            if length > self.maxCommandLength or batch[-1] in endsBatch:
+                break
+            batch.append(cmd)
+        return batch
+
+    def sendQuery(self, cmd):
+        """
+        Send a single query to the ppmac on a command line of its own.
+        :param cmd: Query, e.g. a data structure element name.
+        :return: First line of the reply, as for a query that is not batched.
+        """
+        data = self.sendCommand(cmd)
+        if len(data) == 0:
+            raise IOError(f"No reply from the ppmac to command '{cmd}'.")
+        return data[0]
+
+    def sendCommandBatch(self, cmds, stopOnIllegal=False):
+        """
+        Send several queries to the ppmac on a single gpascii command line and split
+        the reply back onto each query. The ppmac abandons the remainder of a
+        command line once it rejects a command, so the queries following a rejected
+        one are re-sent in a new batch. If the reply can not be split onto the
+        queries, e.g. because a query has a reply of several lines, the queries of
+        the batch are re-sent one at a time.
+        :param cmds: List of queries, each producing a single line of reply, e.g.
+        data structure element names.
+        :param stopOnIllegal: If True, return as soon as a query is rejected rather
+        than re-sending the remaining queries.
+        :return: List of replies in the same order as cmds. If stopOnIllegal is
+        True, the list ends with the first ILLEGAL reply.
+        """
+        if self.pipelinedChannel is not None:
+            # Each query gets its own reply, so no re-sending is needed
+            replies = []
+            for cmd, data in zip(cmds, self.pipelinedChannel.sendCommands(cmds)):
+                if len(data) != 1:
+                    logging.warning(
+                        f"Expected 1 reply from the ppmac to command '{cmd}', "
+                        f"received {len(data)}. Re-sending it on its own."
+                    )
+                    data = [self.sendQuery(cmd)]
+                replies.append(data[0])
+                if stopOnIllegal and "ILLEGAL" in data[0]:
+                    break
+            return replies
+        replies = []
+        remaining = list(cmds)
+        while len(remaining) > 0:
+            batch = self.nextBatch(remaining)
+            remaining = remaining[len(batch) :]
+            data = self.sendCommand(" ".join(batch))
+            illegal = [n for n, reply in enumerate(data) if "ILLEGAL" in reply]
+            if len(illegal) == 0:
+                if len(data) != len(batch):
+                    logging.warning(
+                        f"Expected {len(batch)} replies from the ppmac to batched "
+                        f"command '{' '.join(batch)}', received {len(data)}. "
+                        f"Re-sending its queries one at a time."
+                    )
+                    for cmd in batch:
+                        replies.append(self.sendQuery(cmd))
+                        if stopOnIllegal and "ILLEGAL" in replies[-1]:
+                            return replies
+                    continue
+                replies += data
+                continue
+            if stopOnIllegal:
+                return replies + data[: illegal[0] + 1]
+            if len(data) == len(batch):
+                # Every query in the batch was answered
+                replies += data
+            else:
+                replies += data[: illegal[0] + 1]
+                remaining = batch[illegal[0] + 1 :] + remaining
+        return replies
+
+    def getSymbolsTableCacheFile(self, pp_swtbl_file):
+        return f"{pp_swtbl_file}.cache.npz"
+
+    def readSymbolsTableCache(self, pp_swtbl_file):
+        """
+        Load the symbols parsed from a symbols table file from its compiled cache.
+        The cache is used if the size and modification time of the symbols table
+        file match those it was built from or, failing that, if the hash of its
+        contents does.
+        :param pp_swtbl_file: full path to symbols table file.
+        :return: list of symbols, or None if there is no valid cache.
+        """
+        cacheFile = self.getSymbolsTableCacheFile(pp_swtbl_file)
+        if not fileExists(cacheFile) or not fileExists(pp_swtbl_file):
+            return None
+        try:
+            with np.load(cacheFile, allow_pickle=False) as cache:
+                version = int(cache["version"])
+                size, mtime = (int(value) for value in cache["stat"])
+                digest = str(cache["hash"])
+                cells = cache["cells"].tobytes().decode("ISO-8859-1").split("\x00")
+                rowLengths = cache["rowLengths"].tolist()
+        except (IOError, ValueError, KeyError) as e:
+            logging.info(f"Ignoring unreadable symbols table cache {cacheFile}: {e}")
+            return None
+        if version != self.symbolsTableCacheVersion:
+            return None
+        fileStat = os.stat(pp_swtbl_file)
+        if (fileStat.st_size, fileStat.st_mtime_ns) != (size, mtime):
+            with open(pp_swtbl_file, "rb") as readFile:
+                if hashlib.sha256(readFile.read()).hexdigest() != digest:
+                    return None
+        offsets = [0, *itertools.accumulate(rowLengths)]
+        return [cells[start:end] for start, end in zip(offsets, offsets[1:])]
+
+    def writeSymbolsTableCache(self, pp_swtbl_file, symbols):
+        """
+        Write the symbols parsed from a symbols table file to a compiled cache next
+        to it, holding all of the cells in a single buffer.
+        :param pp_swtbl_file: full path to symbols table file.
+        :param symbols: list of symbols, as returned by swtblFileToList.
+        :return:
+        """
+        cacheFile = self.getSymbolsTableCacheFile(pp_swtbl_file)
+        fileStat = os.stat(pp_swtbl_file)
+        with open(pp_swtbl_file, "rb") as readFile:
+            digest = hashlib.sha256(readFile.read()).hexdigest()
+        cells = "\x00".join(itertools.chain.from_iterable(symbols))
+        if cells.count("\x00") != sum(len(symbol) for symbol in symbols) - 1:
+            logging.info(f"Not caching {pp_swtbl_file}, it contains null characters.")
+            return
+        try:
+            with open(f"{cacheFile}.tmp", "wb") as writeFile:
+                np.savez(
+                    writeFile,
+                    version=self.symbolsTableCacheVersion,
+                    stat=np.array([fileStat.st_size, fileStat.st_mtime_ns], np.int64),
+                    hash=digest,
+                    cells=np.frombuffer(cells.encode("ISO-8859-1"), np.uint8),
+                    rowLengths=np.array([len(symbol) for symbol in symbols], np.int64),
+                )
+            os.replace(f"{cacheFile}.tmp", cacheFile)
+        except IOError as e:
+            logging.info(f"Could not write symbols table cache {cacheFile}: {e}")
+
+    def buildSymbolsTablesCaches(self, databasesDir):
+        """
+        Build the compiled caches of the symbols tables in every copy of the Power
+        PMAC Database found under a directory.
+        :param databasesDir: directory containing copies of the Database directory.
+        :return: list of the symbols tables files that were cached.
+        """
+        cachedFiles = []
+        for root, dirs, files in os.walk(databasesDir):
+            dirs.sort()
+            for pp_swtbl_file in self.pp_swtlbs_symfiles:
+                if pp_swtbl_file in files:
+                    self.swtblFileToList(f"{root}/{pp_swtbl_file}")
+                    cachedFiles.append(f"{root}/{pp_swtbl_file}")
+        return cachedFiles
+
+    def swtblFileToList(self, pp_swtbl_file, useCache=True):
+        """
+        Generate a list of symbols from a symbols table file.
+        :param pp_swtbl_file: full path to symbols table file.
+        :param useCache: load the symbols from the compiled cache of the symbols
+        table file when it is up to date, and otherwise rebuild the cache.
+        :return: swtbl_DSs: list of symbols, where each 'symbol' is represented by
+        the contents of one row of the symbols table file.
+        """
+        if useCache:
+            symbols = self.readSymbolsTableCache(pp_swtbl_file)
+            if symbols is not None:
+                return symbols
+        symbols = self.parseSymbolsTableFile(pp_swtbl_file)
+        if useCache and fileExists(pp_swtbl_file):
+            self.writeSymbolsTableCache(pp_swtbl_file, symbols)
+        return symbols
+
+    def parseSymbolsTableFile(self, pp_swtbl_file):
+        """
+        Parse a symbols table file, where the columns of each row are separated by
+        '\\x01' and rows ending with a backslash continue on the next line.
+        :param pp_swtbl_file: full path to symbols table file.
+        :return: list of symbols.
+        """
+        symbols = []
+        try:
+            file = open(file=pp_swtbl_file, mode="r", encoding="ISO-8859-1")
+            multi_line = ""
+            for line in file:
                 multi_line_ = multi_line
                 if line[-2:] == "\\\n":
                     multi_line += line
@@ -1459,6 +2484,8 @@ class PPMACHardwareWriteRead(object):
         :return: True if data structure or substructure should be ignored, False
         otherwise
         """
+        if isinstance(elementsToIgnore, PPMACIgnoreTrie):
+            return elementsToIgnore.isIgnored(substructure)
         n = substructure.count(".")
         for _ in range(n + 1):
             if substructure in elementsToIgnore:
@@ -1466,387 +2493,714 @@ class PPMACHardwareWriteRead(object):
             substructure = substructure[0 : substructure.rfind(".")]
         return False
 
-    def fillDataStructureIndices_i(
-        self, dataStructure, activeElements, elementsToIgnore, timeout=None
+    def getIndexTemplates(self, dataStructure):
+        """
+        Get the format templates used to fill in the indices of a data structure,
+        built once per data structure so that element names are not rebuilt by
+        string replacement for every index probed.
+        :param dataStructure: String containing the data structure name.
+        :return: Tuple of (template with a replacement field for every index, list
+        of templates with a replacement field for the dim'th index only and the
+        other indices left unfilled), e.g. for Coord[].Q[] ('Coord[{}].Q[{}]',
+        ['Coord[{}].Q[]', 'Coord[].Q[{}]']).
+        """
+        templates = self.indexTemplates.get(dataStructure)
+        if templates is None:
+            parts = dataStructure.replace("{", "{{").replace("}", "}}").split("[]")
+            templates = (
+                "[{}]".join(parts),
+                [
+                    "[]".join(parts[:dim]) + "[{}]" + "[]".join(parts[dim:])
+                    for dim in range(1, len(parts))
+                ],
+            )
+            self.indexTemplates[dataStructure] = templates
+        return templates
+
+    def fillIndices(self, dataStructure, indices):
+        """
+        Fill in the first indices of a data structure name, leaving any remaining
+        indices unfilled.
+        :param dataStructure: String containing the data structure name.
+        :param indices: List of index values (or index strings such as '0..31'),
+        outermost first.
+        :return: String containing the element name.
+        """
+        nameTemplate, dimTemplates = self.getIndexTemplates(dataStructure)
+        return nameTemplate.format(*indices, *[""] * (len(dimTemplates) - len(indices)))
+
+    def generateIndexCandidates(
+        self, dataStructure, outerIndices, elementsToIgnore, start=0
     ):
         """
-        Incrementally increase the index of a singly-indexed data structure and send
-        the resulting command to the ppmac until the maximum accepted index is reached.
-        Add the command string and return value of all commands accepted by
-        the ppmac to the dictionary of active elements.
+        Generate the element names obtained by incrementally increasing the first
+        unfilled index of a data structure, once its outer indices have been filled.
+        Elements in the ignore list are skipped, and generation stops once an
+        open-ended range (e.g. Coord[8:]) in the ignore list is reached.
         :param dataStructure: String containing the data structure name.
-        :param activeElements: Dictionary containing the current set of active elements,
-        where the key is the element name, and the value is a tuple containing
-        the return value from the ppmac and the active element name.
+        :param outerIndices: List of the index values already filled, outermost
+        first.
         :param elementsToIgnore: Set of data structures not to be added to
         activeElements.
-        :return:
+        :param start: First value of the index.
+        :return: Generator of (element name, list of indices) tuples.
         """
-        applyTimeout = False
-        if isinstance(timeout, int) or isinstance(timeout, float):
-            applyTimeout = True
-            startTime = time.time()
-        dataStructureCategory = self.getDataStructureCategory(dataStructure)
-        i = 0
-        cmd_accepted = True
-        while cmd_accepted:
-            i_idex_string = f"[{i}]"
-            dataStructure_i = dataStructure.replace("[]", i_idex_string)
+        dim = len(outerIndices) + 1
+        dimTemplate = self.getIndexTemplates(dataStructure)[1][dim - 1]
+        bound = self.getIndexBound(dataStructure, dim)
+        k = start
+        while bound is None or k < bound:
+            if self.ignoreDataStructure(dimTemplate.format(f"{k}:"), elementsToIgnore):
+                return
+            if self.ignoreDataStructure(dimTemplate.format(k), elementsToIgnore):
+                k += 1
+                continue
+            indices = [*outerIndices, k]
+            yield self.fillIndices(dataStructure, indices), indices
+            k += 1
+
+    def getOpenEndedIndexLimit(self, dataStructure, dim, elementsToIgnore):
+        """
+        Find the lowest index of a data structure's dim'th index at which an
+        open-ended range in the ignore list (e.g. Sys.P[65536:]) starts.
+        :param dataStructure: String containing the data structure name.
+        :param dim: Position of the index in the data structure name, starting at 1.
+        :param elementsToIgnore: Set of data structures not to be added to
+        activeElements.
+        :return: Lowest ignored index, or None if the index is unbounded.
+        """
+        if (dataStructure, dim) in self.openEndedIndexLimits:
+            return self.openEndedIndexLimits[(dataStructure, dim)]
+        if self.openEndedIndexStarts is None:
+            self.openEndedIndexStarts = sorted(
+                {
+                    int(start)
+                    for ignored in elementsToIgnore
+                    for start in re.findall("\\[([0-9]+):\\]", ignored)
+                }
+            )
+        limit = None
+        dimTemplate = self.getIndexTemplates(dataStructure)[1][dim - 1]
+        for start in self.openEndedIndexStarts:
             if self.ignoreDataStructure(
-                dataStructure_i.replace(i_idex_string, f"[{i}:]"), elementsToIgnore
+                dimTemplate.format(f"{start}:"), elementsToIgnore
             ):
+                limit = start
+                break
+        self.openEndedIndexLimits[(dataStructure, dim)] = limit
+        return limit
+
+    def getIgnoredIndexRanges(self, dataStructure, dim, limit, elementsToIgnore):
+        """
+        Find the values of a data structure's dim'th index that are skipped because
+        they are in the ignore list, either individually or as part of a spliced
+        range (e.g. ECAT[].IO[1:4095]).
+        :param dataStructure: String containing the data structure name.
+        :param dim: Position of the index in the data structure name, starting at 1.
+        :param limit: Lowest index not read, or None if the index is unbounded.
+        :param elementsToIgnore: Set of data structures not to be added to
+        activeElements.
+        :return: List of (first, last) tuples of the ignored indices, in ascending
+        order.
+        """
+        if self.ignoredIndexCandidates is None:
+            candidates = set()
+            for ignored in elementsToIgnore:
+                for start, end in re.findall("\\[([0-9]+)(?::([0-9]+))?\\]", ignored):
+                    candidates.update(range(int(start), int(end or start) + 1))
+            self.ignoredIndexCandidates = sorted(candidates)
+        dimTemplate = self.getIndexTemplates(dataStructure)[1][dim - 1]
+        ranges = []
+        for k in self.ignoredIndexCandidates:
+            if limit is not None and k >= limit:
                 break
-            if self.ignoreDataStructure(dataStructure_i, elementsToIgnore):
-                i += 1
+            if not self.ignoreDataStructure(dimTemplate.format(k), elementsToIgnore):
+                continue
+            if len(ranges) > 0 and ranges[-1][1] == k - 1:
+                ranges[-1] = (ranges[-1][0], k)
+            else:
+                ranges.append((k, k))
+        return ranges
+
+    def getIndexLimit(self, dataStructure, dim, elementsToIgnore):
+        """
+        Find the lowest index of a data structure's dim'th index that is not read,
+        either because it is beyond the number of instances read from the Sys.Max*
+        values or because an open-ended range in the ignore list starts there.
+        :param dataStructure: String containing the data structure name.
+        :param dim: Position of the index in the data structure name, starting at 1.
+        :param elementsToIgnore: Set of data structures not to be added to
+        activeElements.
+        :return: Lowest index not read, or None if it is only found by probing.
+        """
+        limit = self.getOpenEndedIndexLimit(dataStructure, dim, elementsToIgnore)
+        bound = self.getIndexBound(dataStructure, dim)
+        if bound is not None and (limit is None or bound < limit):
+            limit = bound
+        return limit
+
+    def estimateQueries(self, dataStructure, count):
+        """
+        Estimate the number of gpascii commands needed to read consecutive values of
+        the last index of a data structure.
+        :param dataStructure: String containing the data structure name.
+        :param count: Number of index values read.
+        :return: Number of commands.
+        """
+        if count == 0:
+            return 0
+        if self.useRangeQueries:
+            return (count + self.rangeSize - 1) // self.rangeSize
+        if self.pipelineWindow > 0:
+            return count
+        name = dataStructure.replace("[]", f"[{count - 1}]")
+        perBatch = len(self.nextBatch([name] * self.batchSize))
+        return (count + perBatch - 1) // perBatch
+
+    def planActiveElementsRead(self, dataStructures, elementsToIgnore):
+        """
+        Intersect a catalog of data structures with the ignore list before anything
+        is read from the ppmac. Data structures that are ignored, or for which no
+        value of one of their indices can be read, are skipped. For the others, the
+        range of each index is found from the Sys.Max* values and the open-ended
+        ranges in the ignore list.
+        :param dataStructures: Iterable containing data structure names.
+        :param elementsToIgnore: Set of data structures not to be added to
+        activeElements.
+        :return: PPMACReadPlan
+        """
+        self.openEndedIndexLimits = {}
+        self.openEndedIndexStarts = None
+        self.ignoredIndexCandidates = None
+        plan = PPMACReadPlan()
+        for ds in dataStructures:
+            if self.ignoreDataStructure(ds, elementsToIgnore):
+                plan.skipped[ds] = "ignored"
+                continue
+            N_brackets = ds.count("[]")
+            if N_brackets == 0:
+                plan.scalars.append(ds)
+                continue
+            limits = []
+            for dim in range(1, N_brackets + 1):
+                limit = self.getIndexLimit(ds, dim, elementsToIgnore)
+                count = None
+                if limit is not None:
+                    # Count the values below the limit that are not ignored
+                    count = sum(
+                        1
+                        for _ in self.generateIndexCandidates(
+                            ds, [0] * (dim - 1), elementsToIgnore
+                        )
+                    )
+                limits.append((limit, count))
+                if count == 0:
+                    plan.skipped[ds] = f"no value of index {dim} is read"
+                    break
+            if ds in plan.skipped:
                 continue
-            # print(dataStructure_i)
-            cmd_return = self.sendCommand(dataStructure_i)
-            # print(cmd_return)
-            if "ILLEGAL" in cmd_return[0]:
-                cmd_accepted = False
+            plan.indexed[ds] = limits
+            # Indices found by probing count as a single value
+            queries = self.estimateQueries(ds, 1 if count is None else count)
+            for _, outerCount in limits[:-1]:
+                queries *= 1 if outerCount is None else outerCount
+            plan.queries += queries
+        if self.pipelineWindow > 0:
+            plan.queries += len(plan.scalars)
+        else:
+            n = 0
+            while n < len(plan.scalars):
+                n += len(self.nextBatch(plan.scalars[n:]))
+                plan.queries += 1
+        return plan
+
+    def findIndexExtent(self, dataStructure, outerIndices, elementsToIgnore):
+        """
+        Find the largest index accepted by the ppmac for the first unfilled index of
+        a data structure, once its outer indices have been filled, using O(log N)
+        probes. Indices 0, 1, 2, 4, 8... are probed until one is rejected, then the
+        interval between the last accepted and first rejected index is narrowed by
+        probing evenly spaced indices within it. Each set of probes is sent as a
+        single batch. Indices in the ignore list are taken to be accepted.
+        :param dataStructure: String containing the data structure name.
+        :param outerIndices: List of the index values already filled, outermost
+        first.
+        :param elementsToIgnore: Set of data structures not to be added to
+        activeElements.
+        :return: Largest accepted index, or -1 if index 0 is rejected.
+        """
+        dim = len(outerIndices) + 1
+        limit = self.getOpenEndedIndexLimit(dataStructure, dim, elementsToIgnore)
+        bound = self.getIndexBound(dataStructure, dim)
+        if bound is not None:
+            # No need to search, the number of instances is already known
+            return bound - 1 if limit is None else min(bound, limit) - 1
+        if limit is None:
+            limit = self.maxIndexExtent + 1
+        if limit == 0:
+            return -1
+
+        dimTemplate = self.getIndexTemplates(dataStructure)[1][dim - 1]
+
+        def probe(indices):
+            # Ignored indices are skipped when reading, rather than ending it, so
+            # they are not sent and count as accepted
+            sent = [
+                k
+                for k in indices
+                if not self.ignoreDataStructure(dimTemplate.format(k), elementsToIgnore)
+            ]
+            if len(sent) == 0:
+                return len(indices)
+            replies = self.sendCommandBatch(
+                [self.fillIndices(dataStructure, [*outerIndices, k]) for k in sent],
+                stopOnIllegal=True,
+            )
+            if "ILLEGAL" in replies[-1]:
+                return indices.index(sent[len(replies) - 1])
+            return len(indices)
+
+        # Gallop: 0, 1, 2, 4, 8... and finally the last index before the limit
+        indices = [0] + [2**n for n in range(limit.bit_length()) if 2**n < limit]
+        if indices[-1] != limit - 1:
+            indices.append(limit - 1)
+        nAccepted = probe(indices)
+        if nAccepted == 0:
+            return -1
+        if nAccepted == len(indices):
+            return limit - 1
+        lo, hi = indices[nAccepted - 1], indices[nAccepted]
+        # Narrow down the interval (lo, hi) between accepted and rejected indices
+        while hi - lo > 1:
+            step = max(1, (hi - lo) // (self.batchSize + 1))
+            indices = list(range(lo + step, hi, step))[: self.batchSize]
+            nAccepted = probe(indices)
+            if nAccepted > 0:
+                lo = indices[nAccepted - 1]
+            if nAccepted < len(indices):
+                hi = indices[nAccepted]
+        return lo
+
+    def readIndices(
+        self,
+        dataStructure,
+        outerIndices,
+        activeElements,
+        elementsToIgnore,
+        startTime,
+        timeout=None,
+        start=0,
+    ):
+        """
+        Read the elements of a data structure obtained by incrementally increasing
+        its first unfilled index, once its outer indices have been filled, in
+        batches, stopping at the first element rejected by the ppmac. Add the
+        element name and return value of all accepted elements to the dictionary of
+        active elements.
+        :param dataStructure: String containing the data structure name.
+        :param outerIndices: List of the index values already filled, outermost
+        first.
+        :param activeElements: Dictionary containing the current set of active
+        elements.
+        :param elementsToIgnore: Set of data structures not to be added to
+        activeElements.
+        :param startTime: Time at which reading of the data structure started.
+        :param timeout: Time in seconds after which reading is abandoned.
+        :param start: First value of the index.
+        :return: Tuple of (number of accepted elements, True if timed-out).
+        """
+        candidates = self.generateIndexCandidates(
+            dataStructure, outerIndices, elementsToIgnore, start
+        )
+        if self.useExtentSearch or self.useRangeQueries:
+            # Only read the indices known to be accepted by the ppmac. A range query
+            # running past the last accepted index is rejected as a whole, so range
+            # queries are capped at the extent
+            extent = self.findIndexExtent(dataStructure, outerIndices, elementsToIgnore)
+            candidates = itertools.takewhile(
+                lambda candidate: candidate[1][-1] <= extent, candidates
+            )
+        dataStructureCategory = self.getDataStructureCategory(dataStructure)
+        accepted = 0
+        while True:
+            if self.useRangeQueries:
+                batch = list(itertools.islice(candidates, self.rangeSize))
             else:
-                activeElements[dataStructure_i] = (
-                    dataStructure_i,
-                    cmd_return[0],
+                batch = list(itertools.islice(candidates, self.batchSize))
+            if len(batch) == 0:
+                return accepted, False
+            if self.useRangeQueries:
+                replies = self.readIndexRanges(dataStructure, batch)
+            else:
+                replies = self.sendCommandBatch(
+                    [name for name, _ in batch], stopOnIllegal=True
+                )
+            for (name, indices), reply in zip(batch, replies):
+                if "ILLEGAL" in reply:
+                    return accepted, False
+                activeElements[name] = (
+                    name,
+                    reply,
                     dataStructureCategory,
                     dataStructure,
-                    [i],
+                    indices,
                 )
-            if applyTimeout and time.time() - startTime > timeout:
+                accepted += 1
+            if isinstance(timeout, (int, float)) and time.time() - startTime > timeout:
                 logging.info(
                     f"Timed-out generating active elements for {dataStructure}. "
-                    f"Last i = {i}."
+                    f"Last indices = {batch[-1][1]}."
                 )
-                return
-            i += 1
+                return accepted, True
 
-    def fillDataStructureIndices_ij(
-        self, dataStructure, activeElements, elementsToIgnore, timeout=None
-    ):
+    def readIndexRanges(self, dataStructure, candidates):
         """
-        Incrementally increase the indices of a doubly-indexed data structure and send
-        the resulting command to the ppmac until the maximum accepted indices are
-        reached. Add the command string and return value of all commands accepted by
-        the ppmac to the dictionary of active elements.
+        Read candidate elements of a data structure from the ppmac using the Power
+        PMAC range syntax, e.g. Motor[0..31].JogSpeed, so that each run of
+        consecutive innermost indices costs a single command. If the ppmac rejects
+        a range, the indices in that range are probed individually instead.
         :param dataStructure: String containing the data structure name.
-        :param activeElements: Dictionary containing the current set of active
-        elements, where the key is the element name, and the value is a tuple
-        containing the return value from the ppmac and the active element name.
-        :param elementsToIgnore: Set of data structures not to be added to
-        activeElements.
-        :return:
+        :param candidates: List of (element name, list of indices) tuples, as
+        produced by generateIndexCandidates.
+        :return: List of replies in the same order as candidates, ending with the
+        first ILLEGAL reply if an element was rejected.
         """
-        applyTimeout = False
-        if isinstance(timeout, int) or isinstance(timeout, float):
-            applyTimeout = True
-            startTime = time.time()
-        dataStructureCategory = self.getDataStructureCategory(dataStructure)
-        i = 0
-        last_i_accepted = i
-        cmd_accepted = True
-        while cmd_accepted:
-            j = 0
-            i_idex_string = f"[{i}]"
-            dataStructure_i = nthRepl(dataStructure, "[]", i_idex_string, 1)
-            if self.ignoreDataStructure(
-                dataStructure_i.replace(i_idex_string, f"[{i}:]"), elementsToIgnore
+        replies = []
+        runStart = 0
+        for n in range(1, len(candidates) + 1):
+            if (
+                n < len(candidates)
+                and candidates[n][1][-1] == candidates[n - 1][1][-1] + 1
             ):
-                break
-            if self.ignoreDataStructure(dataStructure_i, elementsToIgnore):
-                last_i_accepted = i
-                i += 1
                 continue
-            while cmd_accepted:
-                j_idex_string = f"[{j}]"
-                dataStructure_ij = nthRepl(dataStructure_i, "[]", j_idex_string, 1)
-                if self.ignoreDataStructure(
-                    dataStructure_ij.replace(f"[{i}]", "[]", 1).replace(
-                        j_idex_string, f"[{j}:]", 1
-                    ),
-                    elementsToIgnore,
-                ):
-                    break
-                if self.ignoreDataStructure(
-                    dataStructure_ij.replace(f"[{i}]", "[]", 1), elementsToIgnore
-                ):
-                    j += 1
+            run = candidates[runStart:n]
+            runStart = n
+            if len(run) > 1:
+                first, last = run[0][1][-1], run[-1][1][-1]
+                rangeName = self.fillIndices(
+                    dataStructure, [*run[0][1][:-1], f"{first}..{last}"]
+                )
+                data = self.sendCommand(rangeName)
+                if len(data) == len(run) and not any("ILLEGAL" in r for r in data):
+                    replies += data
                     continue
-                # print(dataStructure_ij)
-                cmd_return = self.sendCommand(dataStructure_ij)
-                # print(cmd_return)
-                if "ILLEGAL" in cmd_return[0]:
-                    cmd_accepted = False
-                else:
-                    last_i_accepted = i
-                    activeElements[dataStructure_ij] = (
-                        dataStructure_ij,
-                        cmd_return[0],
-                        dataStructureCategory,
-                        dataStructure,
-                        [i, j],
-                    )
-                if applyTimeout and time.time() - startTime > timeout:
-                    logging.info(
-                        f"Timed-out generating active elements for {dataStructure}. "
-                        f"Last i,j = {i},{j}."
-                    )
-                    return
-                j += 1
-            cmd_accepted = True
-            # print(last_i_accepted, i)
-            if i - last_i_accepted > 1:
-                cmd_accepted = False
-            # print(cmd_accepted)
-            i += 1
-        # print(activeElements)
-
-    def fillDataStructureIndices_ijk(
-        self, dataStructure, activeElements, elementsToIgnore, timeout=None
+                logging.debug(
+                    f"Range query {rangeName} not accepted, reading indices "
+                    "individually."
+                )
+            data = self.sendCommandBatch([name for name, _ in run], stopOnIllegal=True)
+            replies += data
+            if len(data) > 0 and "ILLEGAL" in data[-1]:
+                break
+        return replies
+
+    def fillDataStructureIndices(
+        self,
+        dataStructure,
+        activeElements,
+        elementsToIgnore,
+        timeout=None,
+        outerIndices=(),
+        start=0,
     ):
         """
-        Incrementally increase the indices of a triply-indexed data structure and send
-        the resulting command to the ppmac until the maximum accepted indices are
-        reached. Add the command string and return value of all commands accepted by
+        Enumerate the indices of a data structure with any number of indices and
+        send the resulting commands to the ppmac until the maximum accepted indices
+        are reached. The outer indices are increased one at a time, and for each
+        combination of them the innermost index is read in batches. An outer index
+        stops being increased after two consecutive values of it lead to no accepted
+        elements, unless its number of instances is known from the Sys.Max*
+        values. Add the command string and return value of all commands accepted by
         the ppmac to the dictionary of active elements.
         :param dataStructure: String containing the data structure name.
         :param activeElements: Dictionary containing the current set of active
-        elements, where the key is the element name, and the value is a
-        tuple containing the return value from the ppmac and the active element name.
+        elements, where the key is the element name, and the value is a tuple
+        containing the return value from the ppmac and the active element name.
         :param elementsToIgnore: Set of data structures not to be added to
         activeElements.
+        :param timeout: Time in seconds after which reading is abandoned.
+        :param outerIndices: Values of the outermost indices, which are kept fixed.
+        :param start: Value from which the first index that is not fixed is
+        enumerated. When above 0, the value before it is taken to have accepted
+        elements.
         :return:
         """
-        applyTimeout = False
-        if isinstance(timeout, int) or isinstance(timeout, float):
-            applyTimeout = True
-            startTime = time.time()
-        dataStructureCategory = self.getDataStructureCategory(dataStructure)
-        i = 0
-        last_i_accepted = i
-        cmd_accepted = True
-        # print(dataStructure)
-        while cmd_accepted:
-            j = 0
-            last_j_accepted = j
-            i_idex_string = f"[{i}]"
-            dataStructure_i = nthRepl(dataStructure, "[]", i_idex_string, 1)
-            if self.ignoreDataStructure(
-                dataStructure_i.replace(i_idex_string, f"[{i}:]"), elementsToIgnore
-            ):
-                break
-            if self.ignoreDataStructure(dataStructure_i, elementsToIgnore):
-                last_i_accepted = i
-                i += 1
+        startTime = time.time()
+        nOuter = dataStructure.count("[]") - 1
+        nFixed = len(outerIndices)
+        outerIndices = list(outerIndices)
+        if nFixed == nOuter:
+            self.readIndices(
+                dataStructure,
+                outerIndices,
+                activeElements,
+                elementsToIgnore,
+                startTime,
+                timeout,
+                start,
+            )
+            return
+        # For each outer index being enumerated, outermost first: the remaining
+        # candidate values, the last value, the last value for which elements were
+        # accepted and the number of elements accepted
+        levels = [
+            [
+                self.generateIndexCandidates(
+                    dataStructure, list(outerIndices), elementsToIgnore, start
+                ),
+                start - 1,
+                max(start - 1, 0),
+                0,
+            ]
+        ]
+
+        def finishValue(accepted):
+            dim = nFixed + len(levels)
+            level = levels[-1]
+            i = outerIndices.pop()
+            level[3] += accepted
+            if accepted > 0:
+                level[2] = i
+            if self.getIndexBound(dataStructure, dim) is None and i - level[2] > 1:
+                level[0] = iter(())
+
+        while len(levels) > 0:
+            level = levels[-1]
+            candidate = next(level[0], None)
+            if candidate is None:
+                levels.pop()
+                if len(levels) > 0:
+                    finishValue(level[3])
                 continue
-            #    break
-            while cmd_accepted:
-                k = 0
-                j_idex_string = f"[{j}]"
-                dataStructure_ij = nthRepl(dataStructure_i, "[]", j_idex_string, 1)
-                if self.ignoreDataStructure(
-                    dataStructure_ij.replace(f"[{i}]", "[]", 1).replace(
-                        j_idex_string, f"[{j}:]", 1
-                    ),
-                    elementsToIgnore,
-                ):
-                    break
-                if self.ignoreDataStructure(
-                    dataStructure_ij.replace(f"[{i}]", "[]", 1), elementsToIgnore
-                ):
-                    last_j_accepted = j
-                    j += 1
-                    continue
-                #    break
-                while cmd_accepted:
-                    k_idex_string = f"[{k}]"
-                    dataStructure_ijk = nthRepl(
-                        dataStructure_ij, "[]", k_idex_string, 1
-                    )
-                    if self.ignoreDataStructure(
-                        dataStructure_ijk.replace(f"[{i}]", "[]", 1)
-                        .replace(f"[{j}]", "[]", 1)
-                        .replace(k_idex_string, f"[{k}:]", 1),
-                        elementsToIgnore,
-                    ):
-                        break
-                    if self.ignoreDataStructure(
-                        dataStructure_ijk.replace(f"[{i}]", "[]", 1).replace(
-                            f"[{j}]", "[]", 1
+            i = candidate[1][-1]
+            # Ignored indices count as accepted when deciding when to stop
+            if i != level[1] + 1:
+                level[2] = i - 1
+            level[1] = i
+            outerIndices.append(i)
+            if nFixed + len(levels) < nOuter:
+                levels.append(
+                    [
+                        self.generateIndexCandidates(
+                            dataStructure, list(outerIndices), elementsToIgnore
                         ),
-                        elementsToIgnore,
-                    ):
-                        #    break
-                        k += 1
-                        continue
-                    # print(dataStructure_ijk)
-                    cmd_return = self.sendCommand(dataStructure_ijk)
-                    # print(cmd_return)
-                    if "ILLEGAL" in cmd_return[0]:
-                        cmd_accepted = False
-                    else:
-                        last_j_accepted = j
-                        last_i_accepted = i
-                        activeElements[dataStructure_ijk] = (
-                            dataStructure_ijk,
-                            cmd_return[0],
-                            dataStructureCategory,
-                            dataStructure,
-                            [i, j, k],
-                        )
-                    if applyTimeout and time.time() - startTime > timeout:
-                        logging.info(
-                            f"Timed-out generating active elements for {dataStructure}."
-                            f" Last i,j,k = {i},{j},{k}."
-                        )
-                        return
-                    k += 1
-                cmd_accepted = True
-                if j - last_j_accepted > 1:
-                    cmd_accepted = False
-                j += 1
-            cmd_accepted = True
-            if i - last_i_accepted > 1:
-                cmd_accepted = False
-            i += 1
-        # print(activeElements)
-
-    def fillDataStructureIndices_ijkl(
+                        -1,
+                        0,
+                        0,
+                    ]
+                )
+                continue
+            accepted, timedOut = self.readIndices(
+                dataStructure,
+                list(outerIndices),
+                activeElements,
+                elementsToIgnore,
+                startTime,
+                timeout,
+            )
+            if timedOut:
+                return
+            finishValue(accepted)
+
+    def readPreviousIndices(self, snapshotDir):
+        """
+        Read the indices of the active elements in a previous back-up of the ppmac,
+        grouped by data structure.
+        :param snapshotDir: Directory containing the previous back-up.
+        :return: Dictionary mapping data structure names to sorted lists of index
+        tuples.
+        """
+        fileName = f"{snapshotDir}/active/activeElements.txt"
+        if not fileExists(fileName):
+            logging.info(f"No previous snapshot {fileName}, reading without it.")
+            return {}
+        logging.info(f"Using index extents from previous snapshot {fileName}.")
+        previousIndices = collections.defaultdict(set)
+        with open(fileName, "r") as readFile:
+            for line in readFile:
+                name = line.split(" ", 1)[0].strip()
+                indices = re.findall("\\[([0-9]+)\\]", name)
+                if len(indices) == 0:
+                    continue
+                ds = re.sub("\\[([0-9]+)\\]", "[]", name)
+                previousIndices[ds].add(tuple(int(i) for i in indices))
+        return {ds: sorted(indices) for ds, indices in previousIndices.items()}
+
+    def fillDataStructureIndicesAdaptive(
         self, dataStructure, activeElements, elementsToIgnore, timeout=None
     ):
         """
-        Incrementally increase the indices of a quadruply-indexed data structure and
-        send the resulting command to the ppmac until the maximum accepted
-        indices are reached. Add the command string and return value of all commands
-        accepted by the ppmac to the dictionary of active elements.
+        Read the elements of a data structure using the indices it had in a
+        previous snapshot of the ppmac. The elements in the snapshot are read in
+        batches across all runs of innermost indices, together with sparse probes
+        checking whether the runs have changed: the first index of each gap
+        between the runs and the index following the last one. The probes are
+        likely to be rejected, so each one ends its command line. As when
+        enumerating, the runs of a value of the outer indices end at the first of
+        their elements that is rejected. Only where a probe is accepted is the rest
+        of its gap read, or indices enumerated past the last run as by
+        fillDataStructureIndices.
+        Outer index values missing from the snapshot up to the last one in it are
+        fully enumerated, and each outer index is enumerated past its last value,
+        so that elements added since the snapshot are still found.
         :param dataStructure: String containing the data structure name.
         :param activeElements: Dictionary containing the current set of active
-        elements, where the key is the element name, and the value is a tuple
-        containing the return value from the ppmac and the active element name.
+        elements.
         :param elementsToIgnore: Set of data structures not to be added to
         activeElements.
+        :param timeout: Time in seconds after which reading is abandoned.
         :return:
         """
-        applyTimeout = False
-        if isinstance(timeout, int) or isinstance(timeout, float):
-            applyTimeout = True
-            startTime = time.time()
-        dataStructureCategory = self.getDataStructureCategory(dataStructure)
-        i = 0
-        last_i_accepted = i
-        cmd_accepted = True
-        while cmd_accepted:
-            j = 0
-            last_j_accepted = j
-            i_idex_string = f"[{i}]"
-            dataStructure_i = nthRepl(dataStructure, "[]", i_idex_string, 1)
-            # if self.ignoreDataStructure(dataStructure_i, elementsToIgnore):
-            #    break
-            if self.ignoreDataStructure(
-                dataStructure_i.replace(i_idex_string, f"[{i}:]"), elementsToIgnore
+        startTime = time.time()
+        dimTemplates = self.getIndexTemplates(dataStructure)[1]
+        limits = [
+            self.getIndexLimit(dataStructure, dim, elementsToIgnore)
+            for dim in range(1, len(dimTemplates) + 1)
+        ]
+        known = [
+            indices
+            for indices in self.previousIndices[dataStructure]
+            if not any(
+                (limit is not None and index >= limit)
+                or self.ignoreDataStructure(dimTemplate.format(index), elementsToIgnore)
+                for dimTemplate, limit, index in zip(dimTemplates, limits, indices)
+            )
+        ]
+        if len(known) == 0:
+            self.fillDataStructureIndices(
+                dataStructure, activeElements, elementsToIgnore, timeout
+            )
+            return
+        # Innermost indices of the snapshot for each value of the outer indices
+        runs = collections.defaultdict(set)
+        for indices in known:
+            runs[indices[:-1]].add(indices[-1])
+        # Probe the first index of each gap between the runs, and the index after
+        # the last run
+        probes = []
+        for outerIndices, innerIndices in runs.items():
+            last = max(innerIndices)
+            inGap = False
+            for _, indices in self.generateIndexCandidates(
+                dataStructure, list(outerIndices), elementsToIgnore
             ):
+                if indices[-1] in innerIndices:
+                    inGap = False
+                    continue
+                if not inGap:
+                    probes.append(tuple(indices))
+                    inGap = True
+                if indices[-1] > last:
+                    break
+        candidates = sorted(known + probes)
+        names = [self.fillIndices(dataStructure, indices) for indices in candidates]
+        probeNames = {self.fillIndices(dataStructure, indices) for indices in probes}
+        dataStructureCategory = self.getDataStructureCategory(dataStructure)
+        dsElements = {}
+        n = 0
+        timedOut = False
+        while n < len(names) and not timedOut:
+            batch = self.nextBatch(names[n:], probeNames)
+            replies = self.sendCommandBatch(batch, stopOnIllegal=True)
+            for indices, name, reply in zip(candidates[n:], batch, replies):
+                if "ILLEGAL" not in reply:
+                    dsElements[name] = (
+                        name,
+                        reply,
+                        dataStructureCategory,
+                        dataStructure,
+                        list(indices),
+                    )
+            n += len(replies)
+            if "ILLEGAL" in replies[-1] and names[n - 1] not in probeNames:
+                # As when enumerating, a run ends at its first rejected element
+                outerIndices = candidates[n - 1][:-1]
+                while n < len(names) and candidates[n][:-1] == outerIndices:
+                    n += 1
+            if isinstance(timeout, (int, float)) and time.time() - startTime > timeout:
+                logging.info(
+                    f"Timed-out generating active elements for {dataStructure}. "
+                    f"Last indices = {list(candidates[n - 1])}."
+                )
+                timedOut = True
+        # Read on from the probes that were accepted, to the end of their gap or
+        # past the last run
+        for indices in probes:
+            if timedOut:
                 break
-            if self.ignoreDataStructure(dataStructure_i, elementsToIgnore):
-                last_i_accepted = i
-                i += 1
+            if self.fillIndices(dataStructure, indices) not in dsElements:
                 continue
-            while cmd_accepted:
-                k = 0
-                last_k_accepted = k
-                j_idex_string = f"[{j}]"
-                dataStructure_ij = nthRepl(dataStructure_i, "[]", j_idex_string, 1)
-                if self.ignoreDataStructure(
-                    dataStructure_ij.replace(f"[{i}]", "[]", 1).replace(
-                        j_idex_string, f"[{j}:]", 1
-                    ),
+            innerIndices = runs[indices[:-1]]
+            if indices[-1] > max(innerIndices):
+                _, timedOut = self.readIndices(
+                    dataStructure,
+                    list(indices[:-1]),
+                    dsElements,
                     elementsToIgnore,
-                ):
-                    break
-                if self.ignoreDataStructure(
-                    dataStructure_ij.replace(f"[{i}]", "[]", 1), elementsToIgnore
-                ):
-                    last_j_accepted = j
-                    j += 1
-                    continue
-                while cmd_accepted:
-                    m = 0
-                    k_idex_string = f"[{k}]"
-                    dataStructure_ijk = nthRepl(
-                        dataStructure_ij, "[]", k_idex_string, 1
-                    )
-                    if self.ignoreDataStructure(
-                        dataStructure_ijk.replace(f"[{i}]", "[]", 1)
-                        .replace(f"[{j}]", "[]", 1)
-                        .replace(k_idex_string, f"[{k}:]", 1),
+                    startTime,
+                    timeout,
+                    indices[-1] + 1,
+                )
+                continue
+            gap = list(
+                itertools.takewhile(
+                    lambda candidate: candidate[1][-1] not in innerIndices,
+                    self.generateIndexCandidates(
+                        dataStructure,
+                        list(indices[:-1]),
                         elementsToIgnore,
-                    ):
+                        indices[-1] + 1,
+                    ),
+                )
+            )
+            if len(gap) == 0:
+                continue
+            replies = self.sendCommandBatch(
+                [name for name, _ in gap], stopOnIllegal=True
+            )
+            for (name, gapIndices), reply in zip(gap, replies):
+                if "ILLEGAL" not in reply:
+                    dsElements[name] = (
+                        name,
+                        reply,
+                        dataStructureCategory,
+                        dataStructure,
+                        gapIndices,
+                    )
+        # Fully enumerate the outer index values missing from the snapshot, and
+        # enumerate past the last value of each outer index
+        for dim in range(1, len(dimTemplates)):
+            if timedOut:
+                break
+            outerValues = collections.defaultdict(set)
+            for indices in known:
+                outerValues[indices[: dim - 1]].add(indices[dim - 1])
+            for outerIndices, values in outerValues.items():
+                last = max(values)
+                for _, indices in self.generateIndexCandidates(
+                    dataStructure, list(outerIndices), elementsToIgnore
+                ):
+                    if indices[-1] > last:
                         break
-                    if self.ignoreDataStructure(
-                        dataStructure_ijk.replace(f"[{i}]", "[]", 1).replace(
-                            f"[{j}]", "[]", 1
-                        ),
-                        elementsToIgnore,
-                    ):
-                        #    break
-                        last_k_accepted = k
-                        k += 1
-                        continue
-                    while cmd_accepted:
-                        m_idex_string = f"[{m}]"
-                        dataStructure_ijkm = nthRepl(
-                            dataStructure_ijk, "[]", m_idex_string, 1
-                        )
-                        if self.ignoreDataStructure(
-                            dataStructure_ijkm.replace(f"[{i}]", "[]", 1)
-                            .replace(f"[{j}]", "[]", 1)
-                            .replace(f"[{k}]", "[]", 1)
-                            .replace(m_idex_string, f"[{m}:]", 1),
-                            elementsToIgnore,
-                        ):
-                            break
-                        if self.ignoreDataStructure(
-                            dataStructure_ijkm.replace(f"[{i}]", "[]", 1)
-                            .replace(f"[{j}]", "[]", 1)
-                            .replace(f"[{k}]", "[]", 1),
+                    if indices[-1] not in values:
+                        self.fillDataStructureIndices(
+                            dataStructure,
+                            dsElements,
                             elementsToIgnore,
-                        ):
-                            m += 1
-                            continue
-                        # print(dataStructure_ijkm)
-                        cmd_return = self.sendCommand(dataStructure_ijkm)
-                        # print(cmd_return)
-                        if "ILLEGAL" in cmd_return[0]:
-                            cmd_accepted = False
-                        else:
-                            last_k_accepted = k
-                            last_j_accepted = j
-                            last_i_accepted = i
-                            activeElements[dataStructure_ijkm] = (
-                                dataStructure_ijkm,
-                                cmd_return[0],
-                                dataStructureCategory,
-                                dataStructure,
-                                [i, j, k, m],
-                            )
-                        if applyTimeout and time.time() - startTime > timeout:
-                            logging.info(
-                                "Timed-out generating active elements for"
-                                f" {dataStructure}. Last i,j,k,m = {i},{j},{k},{m}."
-                            )
-                            return
-                        m += 1
-                    cmd_accepted = True
-                    if k - last_k_accepted > 1:
-                        cmd_accepted = False
-                    k += 1
-                cmd_accepted = True
-                if j - last_j_accepted > 1:
-                    cmd_accepted = False
-                j += 1
-            cmd_accepted = True
-            if i - last_i_accepted > 1:
-                cmd_accepted = False
-            i += 1
-        # print(activeElements)
+                            timeout,
+                            indices,
+                        )
+                self.fillDataStructureIndices(
+                    dataStructure,
+                    dsElements,
+                    elementsToIgnore,
+                    timeout,
+                    outerIndices,
+                    last + 1,
+                )
+        # Keep the same order as fillDataStructureIndices
+        for name, element in sorted(dsElements.items(), key=lambda item: item[1][4]):
+            activeElements[name] = element
 
     def scpPPMACDatabaseToLocal(self, remote_db_path, local_db_path):
         if not os.path.isdir(local_db_path):
@@ -1855,89 +3209,59 @@ class PPMACHardwareWriteRead(object):
             source=remote_db_path, destination=local_db_path, recursive=True
         )
 
+    def indexSymbolsByParent(self, symbols):
+        """
+        Group the rows of a symbols table by the name of their parent structure,
+        held in the second column.
+        :param symbols: list of symbols, as returned by swtblFileToList.
+        :return: dictionary mapping parent structure names to lists of rows, in the
+        order they appear in the symbols table.
+        """
+        symbolsByParent = collections.defaultdict(list)
+        for symbol in symbols:
+            symbolsByParent[symbol[1]].append(symbol)
+        return symbolsByParent
+
     def createDataStructuresFromSymbolsTables(self, pp_swtlbs_symfiles, local_db_path):
         """
         Read the symbols tables and create a list of data structure names contained
-        within them.
+        within them. swtbl2 and swtbl3 are indexed by parent structure, so that the
+        join of swtbl1 -> swtbl2 -> swtbl3 takes time linear in the size of the
+        output.
         :return: dataStructures: list of data structure names
         """
         # Clear current data structure dictionary
         dataStructures = {}
-        # swtbl0 = []
-        # with open(self.local_db_path + '/' + self.pp_swtbl0_txtfile, 'r') as readFile:
-        #    for line in readFile:
-        #        swtbl0.append(line.replace('\n',''))
         pp_swtbls = []
         for pp_swtbl_file in pp_swtlbs_symfiles:
             pp_swtbls.append(self.swtblFileToList(local_db_path + "/" + pp_swtbl_file))
-        swtbl1_nparray = np.asarray(pp_swtbls[0])
-        swtbl2_nparray = np.asarray(pp_swtbls[1])
-        swtbl3_nparray = np.asarray(pp_swtbls[2])
-        # for baseDS in swtbl0:
-        #    print(baseDS)
-        #    substruct_01 = False
-        for i in range(swtbl1_nparray.shape[0]):
-            #    if baseDS == swtbl1_nparray[i, 1]:
-            #        substruct_01 = True
+        swtbl1 = pp_swtbls[0]
+        swtbl2ByParent = self.indexSymbolsByParent(pp_swtbls[1])
+        swtbl3ByParent = self.indexSymbolsByParent(pp_swtbls[2])
+        for symbol1 in swtbl1:
+            base = symbol1[1]
+            # Substructures apply to any base when their base column is NULL
+            baseName = base.replace("[]", "")
             substruct_12 = False
-            for j in range(swtbl2_nparray.shape[0]):
-                if swtbl1_nparray[i, 2] == swtbl2_nparray[j, 1]:
-                    if (
-                        swtbl1_nparray[i, 1].replace("[]", "")
-                        != swtbl2_nparray[j, 5].replace("[]", "")
-                    ) and (swtbl2_nparray[j, 5] != "NULL"):
+            for symbol2 in swtbl2ByParent.get(symbol1[2], []):
+                if symbol2[5] != "NULL" and baseName != symbol2[5].replace("[]", ""):
+                    continue
+                substruct_12 = True
+                substruct_23 = False
+                for symbol3 in swtbl3ByParent.get(symbol2[2], []):
+                    if symbol3[5] != "NULL" and baseName != symbol3[5].replace(
+                        "[]", ""
+                    ):
                         continue
-                    substruct_12 = True
-                    substruct_23 = False
-                    for k in range(swtbl3_nparray.shape[0]):
-                        if swtbl2_nparray[j, 2] == swtbl3_nparray[k, 1]:
-                            if (
-                                swtbl1_nparray[i, 1].replace("[]", "")
-                                != swtbl3_nparray[k, 5].replace("[]", "")
-                            ) and (swtbl3_nparray[k, 5] != "NULL"):
-                                continue
-                            substruct_23 = True
-                            dsName = (
-                                swtbl1_nparray[i, 1]
-                                + "."
-                                + swtbl2_nparray[j, 1]
-                                + "."
-                                + swtbl3_nparray[k, 1]
-                                + "."
-                                + swtbl3_nparray[k, 2]
-                            )
-                            # print(dsName)
-                            dataStructures[dsName] = [
-                                dsName,
-                                swtbl1_nparray[i, 1],
-                                *(swtbl3_nparray[k, 3:].tolist()),
-                            ]
-                    if substruct_23 is False:
-                        dsName = (
-                            swtbl1_nparray[i, 1]
-                            + "."
-                            + swtbl2_nparray[j, 1]
-                            + "."
-                            + swtbl2_nparray[j, 2]
-                        )
-                        # print(dsName)
-                        dataStructures[dsName] = [
-                            dsName,
-                            swtbl1_nparray[i, 1],
-                            *(swtbl2_nparray[j, 3:].tolist()),
-                        ]
+                    substruct_23 = True
+                    dsName = f"{base}.{symbol2[1]}.{symbol3[1]}.{symbol3[2]}"
+                    dataStructures[dsName] = [dsName, base, *symbol3[3:]]
+                if substruct_23 is False:
+                    dsName = f"{base}.{symbol2[1]}.{symbol2[2]}"
+                    dataStructures[dsName] = [dsName, base, *symbol2[3:]]
             if substruct_12 is False:
-                dsName = swtbl1_nparray[i, 1] + "." + swtbl1_nparray[i, 2]
-                # print(dsName)
-                dataStructures[dsName] = [
-                    dsName,
-                    swtbl1_nparray[i, 1],
-                    *(swtbl1_nparray[i, 3:].tolist()),
-                ]
-        # if substruct_01 == False:
-        #    print(baseDS)
-        #    dataStructures.append(baseDS)
-        #    writeFile.write(baseDS.printInfo() + '\n')
+                dsName = f"{base}.{symbol1[2]}"
+                dataStructures[dsName] = [dsName, base, *symbol1[3:]]
         return dataStructures
 
     def checkDataStructuresValidity(self, dataStructures):
@@ -1953,9 +3277,10 @@ class PPMACHardwareWriteRead(object):
             "and removing any invalid data structures..."
         )
         invalidCount = 0
-        for ds in list(dataStructures):
-            cmd_return = self.sendCommand(ds.replace("[]", "[0]"))
-            if "ILLEGAL" in cmd_return[0]:
+        dsNames = list(dataStructures)
+        replies = self.sendCommandBatch([ds.replace("[]", "[0]") for ds in dsNames])
+        for ds, reply in zip(dsNames, replies):
+            if "ILLEGAL" in reply:
                 logging.debug(
                     f"{ds.replace('[]', '[0]')} not a valid ppmac command, deleting"
                     " from dictionary of data structures."
@@ -1968,6 +3293,46 @@ class PPMACHardwareWriteRead(object):
         )
         return dataStructures
 
+    def getCatalogCacheKey(self, pp_swtlbs_symfiles, local_db_path):
+        """
+        Generate the key identifying a catalog of valid data structures, from the
+        contents of the symbols tables files and the firmware version and model of
+        the ppmac.
+        :return: String containing a hexadecimal hash.
+        """
+        key = hashlib.sha256()
+        for pp_swtbl_file in pp_swtlbs_symfiles:
+            with open(f"{local_db_path}/{pp_swtbl_file}", "rb") as readFile:
+                key.update(readFile.read())
+        for reply in self.sendCommandBatch(["vers", "cid"]):
+            key.update(reply.encode())
+        return key.hexdigest()
+
+    def getValidDataStructures(self, dataStructures):
+        """
+        Remove invalid data structures from a dictionary of data structures, using
+        the catalog of valid data structures cached for the same symbols tables and
+        firmware if there is one. Otherwise the validity of each data structure is
+        checked with the ppmac and the resulting catalog is cached.
+        :param dataStructures: Dictionary of data structures, as returned by
+        createDataStructuresFromSymbolsTables.
+        :return: Dictionary of valid data structures.
+        """
+        if self.cacheDir is None:
+            return self.checkDataStructuresValidity(dataStructures)
+        key = self.getCatalogCacheKey(self.pp_swtlbs_symfiles, self.local_db_path)
+        cacheFile = f"{self.cacheDir}/catalog_{key}.json"
+        if fileExists(cacheFile):
+            logging.info(f"Using cached catalog of valid data structures {cacheFile}.")
+            with open(cacheFile, "r") as readFile:
+                return json.load(readFile)
+        validDataStructures = self.checkDataStructuresValidity(dataStructures)
+        os.makedirs(self.cacheDir, exist_ok=True)
+        with open(f"{cacheFile}.tmp", "w+") as writeFile:
+            json.dump(validDataStructures, writeFile)
+        os.replace(f"{cacheFile}.tmp", cacheFile)
+        return validDataStructures
+
     def getActiveElementsFromDataStructures(
         self, dataStructures, elementsToIgnore, recordTimings=False, timeout=None
     ):
@@ -1987,41 +3352,359 @@ class PPMACHardwareWriteRead(object):
         )
         fncStartTime = time.time()
         activeElements = {}
-        for ds in dataStructures:
-            loopStartTime = time.time()
-            N_brackets = ds.count("[]")
-            if N_brackets == 0:
-                value = self.sendCommand(ds)[0]
+        if self.previousSnapshotDir is not None:
+            self.previousIndices = self.readPreviousIndices(self.previousSnapshotDir)
+        plan = self.planActiveElementsRead(dataStructures, elementsToIgnore)
+        logging.info(
+            f"Skipping {len(plan.skipped)} ignored data structures, estimated "
+            f"{plan.queries} queries to read the others."
+        )
+        completed = self.startCheckpoint(plan)
+        # Read all un-indexed data structures in batches
+        if None in completed:
+            self.storeActiveElements(activeElements, completed[None])
+        else:
+            scalarElements = {}
+            for ds, value in zip(plan.scalars, self.sendCommandBatch(plan.scalars)):
                 category = self.getDataStructureCategory(ds)
-                activeElements[ds] = (ds, value, category, ds, None)
-            elif N_brackets == 1:
-                self.fillDataStructureIndices_i(
-                    ds, activeElements, elementsToIgnore, timeout=timeout
-                )
-            elif N_brackets == 2:
-                self.fillDataStructureIndices_ij(
-                    ds, activeElements, elementsToIgnore, timeout=timeout
-                )
-            elif N_brackets == 3:
-                self.fillDataStructureIndices_ijk(
-                    ds, activeElements, elementsToIgnore, timeout=timeout
-                )
-            elif N_brackets == 4:
-                self.fillDataStructureIndices_ijkl(
-                    ds, activeElements, elementsToIgnore, timeout=timeout
-                )
-            else:
-                logging.info(
-                    f"Too many indexed substructures in data structure '{ds}'."
-                    " Ignoring."
-                )
-                continue
-            if recordTimings:
-                logging.info(ds + f"   time: {time.time() - loopStartTime} sec")
+                scalarElements[ds] = (ds, value, category, ds, None)
+            self.writeCheckpoint(None, scalarElements)
+            self.storeActiveElements(activeElements, scalarElements)
+        indexed = list(plan.indexed.keys())
+        if self.channels > 1:
+            self.readDataStructuresInParallel(
+                indexed,
+                activeElements,
+                elementsToIgnore,
+                recordTimings,
+                timeout,
+                completed,
+            )
+        else:
+            for ds in indexed:
+                dsElements = completed.get(ds, {})
+                if ds not in completed:
+                    self.readDataStructure(
+                        ds, dsElements, elementsToIgnore, recordTimings, timeout
+                    )
+                self.storeActiveElements(activeElements, dsElements)
         logging.info("Finished generating dictionary of active elements. ")
         logging.info(f"Total time = {time.time() - fncStartTime} sec")
         return activeElements
 
+    def storeActiveElements(self, activeElements, elements):
+        """
+        Add the active elements of a data structure that has been read to the
+        dictionary of active elements or, when streaming, pass them to the writer
+        thread instead.
+        :param activeElements: Dictionary containing the current set of active
+        elements.
+        :param elements: Dictionary of the active elements to add.
+        :return:
+        """
+        if self.activeElementsWriter is None:
+            activeElements.update(elements)
+            return
+        for element in elements.values():
+            self.activeElementsWriter.put(element)
+
+    def readDataStructure(
+        self, ds, activeElements, elementsToIgnore, recordTimings=False, timeout=None
+    ):
+        """
+        Read all active elements of an indexed data structure from the ppmac.
+        :param ds: String containing the data structure name.
+        :param activeElements: Dictionary containing the current set of active
+        elements.
+        :param elementsToIgnore: Set of data structures not to be added to
+        activeElements.
+        :return:
+        """
+        loopStartTime = time.time()
+        dsElements = {}
+        # Range queries already read each run of indices with a single command
+        if ds in self.previousIndices and not self.useRangeQueries:
+            self.fillDataStructureIndicesAdaptive(
+                ds, dsElements, elementsToIgnore, timeout=timeout
+            )
+        else:
+            self.fillDataStructureIndices(
+                ds, dsElements, elementsToIgnore, timeout=timeout
+            )
+        self.writeCheckpoint(ds, dsElements)
+        activeElements.update(dsElements)
+        if recordTimings:
+            logging.info(ds + f"   time: {time.time() - loopStartTime} sec")
+
+    def getCheckpointFile(self):
+        return f"{self.local_db_path}/activeElements.checkpoint"
+
+    def startCheckpoint(self, plan):
+        """
+        Start recording the active elements of each data structure to a checkpoint
+        file once all of them have been read. If resuming, first load the data
+        structures already recorded by an interrupted read with the same plan.
+        :param plan: PPMACReadPlan of the read.
+        :return: Dictionary mapping the data structures already read to
+        dictionaries of their active elements. The un-indexed data structures are
+        recorded together under None.
+        """
+        self.checkpointFile = None
+        if self.local_db_path is None:
+            return {}
+        checkpointFile = self.getCheckpointFile()
+        key = hashlib.sha256(plan.report().encode()).hexdigest()
+        completed = {}
+        if self.resume and fileExists(checkpointFile):
+            with open(checkpointFile, "r") as readFile:
+                header = readFile.readline()
+                if header.strip() == json.dumps({"plan": key}):
+                    for line in readFile:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            # Record interrupted while being written
+                            break
+                        completed[record["dataStructure"]] = {
+                            element[0]: tuple(element) for element in record["elements"]
+                        }
+                else:
+                    logging.info(
+                        f"Checkpoint {checkpointFile} was written for a different "
+                        "plan, reading all data structures."
+                    )
+            logging.info(
+                f"Resuming from checkpoint {checkpointFile}, {len(completed)} data "
+                "structures already read."
+            )
+        os.makedirs(self.local_db_path, exist_ok=True)
+        with open(f"{checkpointFile}.tmp", "w+") as writeFile:
+            writeFile.write(json.dumps({"plan": key}) + "\n")
+            for ds, elements in completed.items():
+                record = {"dataStructure": ds, "elements": list(elements.values())}
+                writeFile.write(json.dumps(record) + "\n")
+        os.replace(f"{checkpointFile}.tmp", checkpointFile)
+        self.checkpointFile = checkpointFile
+        return completed
+
+    def writeCheckpoint(self, ds, elements):
+        """
+        Append the active elements of a data structure that has been read to the
+        checkpoint file.
+        :param ds: String containing the data structure name, or None for the
+        un-indexed data structures.
+        :param elements: Dictionary of the active elements of the data structure.
+        :return:
+        """
+        if self.checkpointFile is None:
+            return
+        record = {"dataStructure": ds, "elements": list(elements.values())}
+        with self.checkpointLock:
+            with open(self.checkpointFile, "a") as writeFile:
+                writeFile.write(json.dumps(record) + "\n")
+
+    def removeCheckpoint(self):
+        if self.checkpointFile is not None and fileExists(self.checkpointFile):
+            os.remove(self.checkpointFile)
+        self.checkpointFile = None
+
+    def openChannel(self):
+        """
+        Open an additional gpascii session to the ppmac that the module-level
+        sshClient is connected to.
+        :return: Connected dls_pmacremote.PPmacSshInterface object.
+        """
+        client = dls_pmacremote.PPmacSshInterface()
+        client.hostname = sshClient.hostname
+        client.port = sshClient.port
+        if self.username is not None and self.password is not None:
+            connectStatus = client.connect(
+                username=self.username, password=self.password
+            )
+        else:
+            connectStatus = client.connect()
+        if connectStatus is not None:
+            raise IOError(
+                f"Cannot open additional gpascii session to Power PMAC at "
+                f"{client.hostname}:{client.port}: {connectStatus}"
+            )
+        return client
+
+    def readDataStructuresInParallel(
+        self,
+        dataStructures,
+        activeElements,
+        elementsToIgnore,
+        recordTimings=False,
+        timeout=None,
+        completed=None,
+    ):
+        """
+        Read the active elements of a list of indexed data structures using
+        several independent gpascii sessions. Each session takes data structures
+        from a shared work queue, and the results are merged into activeElements
+        in the order of dataStructures.
+        :param dataStructures: List of indexed data structure names.
+        :param activeElements: Dictionary containing the current set of active
+        elements.
+        :param elementsToIgnore: Set of data structures not to be added to
+        activeElements.
+        :param completed: Dictionary mapping data structures that have already
+        been read to dictionaries of their active elements.
+        :return:
+        """
+        workQueue = queue.Queue()
+        results = {}
+        completed = {} if completed is None else completed
+        for position, ds in enumerate(dataStructures):
+            if ds in completed:
+                results[position] = completed[ds]
+            else:
+                workQueue.put((position, ds))
+        errors = []
+        resultReady = threading.Condition()
+
+        def work(reader):
+            try:
+                while not errors:
+                    try:
+                        position, ds = workQueue.get_nowait()
+                    except queue.Empty:
+                        return
+                    dsElements = {}
+                    reader.readDataStructure(
+                        ds, dsElements, elementsToIgnore, recordTimings, timeout
+                    )
+                    with resultReady:
+                        results[position] = dsElements
+                        resultReady.notify()
+            except Exception as e:
+                with resultReady:
+                    errors.append(e)
+                    resultReady.notify()
+
+        # The existing session is used as one of the channels
+        readers = [self]
+        try:
+            for _ in range(min(self.channels, workQueue.qsize()) - 1):
+                reader = copy.copy(self)
+                reader.gpasciiClient = self.openChannel()
+                reader.pipelinedChannel = None
+                readers.append(reader)
+                reader.openPipelinedChannel()
+            logging.info(
+                f"Reading {workQueue.qsize()} data structures using "
+                f"{len(readers)} gpascii sessions."
+            )
+            threads = [
+                threading.Thread(target=work, args=(reader,)) for reader in readers
+            ]
+            for thread in threads:
+                thread.start()
+            # Store the results in order as soon as they are available
+            for position in range(len(dataStructures)):
+                with resultReady:
+                    while position not in results and not errors:
+                        resultReady.wait(1.0)
+                    if errors:
+                        break
+                    dsElements = results.pop(position)
+                self.storeActiveElements(activeElements, dsElements)
+            for thread in threads:
+                thread.join()
+        finally:
+            for reader in readers[1:]:
+                reader.closePipelinedChannel()
+                reader.gpasciiClient.disconnect()
+        if errors:
+            raise errors[0]
+
+    def dumpActiveElementsOnController(self, dataStructures, elementsToIgnore):
+        """
+        Generate a dictionary of active elements by running a script on the ppmac
+        that reads every element of the given data structures through a local
+        gpascii session. The elements are written to a single compressed file,
+        which is then copied back in one transfer.
+        :param dataStructures: Iterable containing data structure names
+        :param elementsToIgnore: Set of data structures not to be added to included
+        in the active elements read from the ppmac.
+        :return: Dictionary of active elements, as returned by
+        getActiveElementsFromDataStructures.
+        """
+        logging.info(
+            "dumpActiveElementsOnController: reading active elements on the ppmac..."
+        )
+        localDumpDir = f"{self.local_db_path}/dump"
+        os.makedirs(localDumpDir, exist_ok=True)
+        plan = self.planActiveElementsRead(dataStructures, elementsToIgnore)
+        structuresFile = f"{localDumpDir}/structures.txt"
+        with open(structuresFile, "w+") as writeFile:
+            for ds in plan.scalars:
+                writeFile.write(f"{ds}\n")
+            for ds, limits in plan.indexed.items():
+                specs = []
+                for dim, (limit, _) in enumerate(limits, 1):
+                    ranges = self.getIgnoredIndexRanges(
+                        ds, dim, limit, elementsToIgnore
+                    )
+                    specs.append(
+                        f"{-1 if limit is None else limit}:"
+                        + ",".join(f"{first}-{last}" for first, last in ranges)
+                    )
+                writeFile.write(" ".join([ds] + specs) + "\n")
+        dumpScript = f"{localDumpDir}/dump.sh"
+        with open(dumpScript, "w+") as writeFile:
+            writeFile.write(activeStateDumpCmds)
+        executeRemoteShellCommand(f"mkdir -p {self.remoteDumpDir}")
+        scpFromLocalToPowerPMAC([structuresFile, dumpScript], f"{self.remoteDumpDir}/")
+        executeRemoteShellCommand(f"bash {self.remoteDumpDir}/dump.sh")
+        scpFromPowerPMACtoLocal(
+            f"{self.remoteDumpDir}/activeElements.txt.gz",
+            f"{localDumpDir}/",
+            recursive=False,
+        )
+        executeRemoteShellCommand(f"rm -rf {self.remoteDumpDir}")
+        return self.readActiveElementsDump(
+            f"{localDumpDir}/activeElements.txt.gz", elementsToIgnore
+        )
+
+    def readActiveElementsDump(self, dumpFile, elementsToIgnore):
+        """
+        Generate a dictionary of active elements from the compressed file written
+        by the script run by dumpActiveElementsOnController. Each line of the file
+        holds an element name followed by its value.
+        :param dumpFile: Path to the compressed file.
+        :param elementsToIgnore: Set of data structures not to be added to included
+        in the active elements.
+        :return: Dictionary of active elements, as returned by
+        getActiveElementsFromDataStructures.
+        """
+        activeElements = {}
+        with gzip.open(dumpFile, "rt", encoding="ISO-8859-1") as readFile:
+            for line in readFile:
+                name, _, value = line.rstrip("\n").partition(" ")
+                if name == "":
+                    continue
+                ds = re.sub("\\[([0-9]+)\\]", "[]", name)
+                indices = [int(i) for i in re.findall("\\[([0-9]+)\\]", name)]
+                dimTemplates = self.getIndexTemplates(ds)[1]
+                if any(
+                    self.ignoreDataStructure(
+                        dimTemplate.format(index), elementsToIgnore
+                    )
+                    for dimTemplate, index in zip(dimTemplates, indices)
+                ):
+                    continue
+                category = self.getDataStructureCategory(ds)
+                activeElements[name] = (
+                    name,
+                    value,
+                    category,
+                    ds,
+                    indices if len(indices) > 0 else None,
+                )
+        return activeElements
+
     def expandSplicedIndices(self, splicedDataStructure):
         """
         Stuff
@@ -2046,6 +3729,11 @@ class PPMACHardwareWriteRead(object):
             return expandedDataStructure
 
     def generateIgnoreSet(self, ignoreFile):
+        """
+        Compile the data structures listed in an ignore file.
+        :param ignoreFile: Path to the ignore file.
+        :return: PPMACIgnoreTrie holding the data structures to ignore.
+        """
         ignore = []
         logging.info(f"Using ignore file {ignoreFile}.")
         with open(ignoreFile, "r") as readFile:
@@ -2053,41 +3741,85 @@ class PPMACHardwareWriteRead(object):
                 line = line.split("#", 1)[0]
                 line = line.strip()
                 ignore += line.split()
-        expandedIgnore = [
-            item
-            for dataStructure in ignore
-            for item in self.expandSplicedIndices(dataStructure)
-        ]
-        return set(expandedIgnore)
+        return PPMACIgnoreTrie(ignore)
 
     def copyDict(self, destValueType, sourceDict):
         return {key: destValueType(*value) for key, value in sourceDict.items()}
 
-    @timer
-    def readAndStoreActiveState(self, pathToIgnoreFile):
+    def readValidDataStructures(self):
+        """
+        Copy the symbols tables from the ppmac and generate the dictionary of data
+        structures valid on it. Also read the number of instances of the top-level
+        data structures.
+        :return: Dictionary of valid data structures.
+        """
         if self.local_db_path is None:
             raise IOError(
                 "Need to specify temporary directory where Power PMAC Database can be"
                 " copied to."
             )
         os.makedirs(self.local_db_path, exist_ok=True)
+        # Read the number of instances of the top-level data structures
+        self.readSysMaxes()
         self.scpPPMACDatabaseToLocal("/var/ftp/usrflash/Database/*", self.local_db_path)
-        # Store data structures in ppmac object
         dataStructures = self.createDataStructuresFromSymbolsTables(
             self.pp_swtlbs_symfiles, self.local_db_path
         )
-        validDataStructures = self.checkDataStructuresValidity(dataStructures)
+        return self.getValidDataStructures(dataStructures)
+
+    @timer
+    @openClosePipelinedChannel
+    def planActiveState(self, pathToIgnoreFile, planFile):
+        """
+        Work out which active elements would be read from the ppmac, without reading
+        them, and write the plan to a file.
+        :param pathToIgnoreFile: Path to the ignore file.
+        :param planFile: Path to the file the plan is written to.
+        :return: PPMACReadPlan
+        """
+        validDataStructures = self.readValidDataStructures()
+        elementsToIgnore = self.generateIgnoreSet(pathToIgnoreFile)
+        plan = self.planActiveElementsRead(validDataStructures, elementsToIgnore)
+        with open(planFile, "w+") as writeFile:
+            writeFile.write(plan.report())
+        logging.info(f"Wrote plan for reading active elements to {planFile}.")
+        return plan
+
+    @timer
+    @openClosePipelinedChannel
+    def readAndStoreActiveState(self, pathToIgnoreFile):
+        # Store data structures in ppmac object
+        validDataStructures = self.readValidDataStructures()
         # Store the dictionary of data strutures in the ppmac object
         self.ppmacInstance.dataStructures = self.copyDict(
             self.ppmacInstance.DataStructure, validDataStructures
         )
+        if self.cacheDir is not None:
+            self.ppmacInstance.tokenCache = PPMACTokenCache(f"{self.cacheDir}/tokens")
         # Store active elements in ppmac object
         elementsToIgnore = self.generateIgnoreSet(pathToIgnoreFile)
-        activeElements = self.getActiveElementsFromDataStructures(
-            validDataStructures, elementsToIgnore, recordTimings=True
-        )  # timeout=10.0
-        self.ppmacInstance.activeElements = self.copyDict(
-            self.ppmacInstance.ActiveElement, activeElements
+        if self.streamFile is not None:
+            self.activeElementsWriter = PPMACActiveElementsWriter(self.streamFile)
+        try:
+            if self.useControllerDump:
+                activeElements = self.dumpActiveElementsOnController(
+                    validDataStructures, elementsToIgnore
+                )
+                if self.activeElementsWriter is not None:
+                    self.storeActiveElements({}, activeElements)
+                    activeElements = {}
+            else:
+                activeElements = self.getActiveElementsFromDataStructures(
+                    validDataStructures, elementsToIgnore, recordTimings=True
+                )  # timeout=10.0
+            if self.activeElementsWriter is not None:
+                self.activeElementsWriter.close()
+        finally:
+            if self.activeElementsWriter is not None:
+                self.activeElementsWriter.close(keep=False)
+                self.activeElementsWriter = None
+        self.ppmacInstance.activeElements = self.ppmacInstance.ActiveElementStore(
+            activeElements.values()
         )
         bufferedProgramsInfo = self.getBufferedProgramsInfo()
         self.appendBufferedProgramsInfoWithListings(bufferedProgramsInfo)
@@ -2110,6 +3842,8 @@ class PPMACHardwareWriteRead(object):
         self.ppmacInstance.coordSystemDefs = self.copyDict(
             self.ppmacInstance.CoordSystemDefinition, coordSystemMotorDefs
         )
+        # Everything has been read, so there is nothing left to resume
+        self.removeCheckpoint()
 
     def getCoordSystemMotorDefinitions(self):
         coordSystemMotorDefinitions = {}
@@ -2140,18 +3874,32 @@ class PPMACHardwareWriteRead(object):
         return coordSystemMotorDefinitions
 
     def appendBufferedProgramsInfoWithListings(self, bufferedProgramsInfo):
+        programsInfo, cmds = [], []
         for programType in bufferedProgramsInfo.keys():
             for programInfo in bufferedProgramsInfo[programType].values():
                 programName = programInfo[0]
-                programListing = []
                 if programType == "Forward" or programType == "Inverse":
                     progCoordSystem = programInfo[4]
-                    listing = self.sendCommand(f"&{progCoordSystem} list {programType}")
+                    cmds.append(f"&{progCoordSystem} list {programType}")
                 else:
-                    listing = self.sendCommand(f"list {programName}")
-                for line in listing:
-                    programListing.append(line + "\n")
-                programInfo.append(programListing)
+                    cmds.append(f"list {programName}")
+                programsInfo.append(programInfo)
+        for programInfo, listing in zip(programsInfo, self.sendListCommands(cmds)):
+            programInfo.append([line + "\n" for line in listing])
+
+    def sendListCommands(self, cmds):
+        """
+        Send the commands listing the programs. On a pipelined gpascii session they
+        are pipelined, so that several listings are requested in each round trip.
+        Otherwise they are sent one at a time, as the replies to several list
+        commands on one line can not be split back onto each program.
+        :param cmds: List of list commands, e.g. 'list plc1'.
+        :return: List of the listings, each a list of lines, in the same order as
+        cmds.
+        """
+        if self.pipelinedChannel is not None:
+            return self.pipelinedChannel.sendCommands(cmds)
+        return [self.sendCommand(cmd) for cmd in cmds]
 
     def getBufferedProgramsInfo(self):
         motion, subProgs, plcs, inverse, forward = ({} for _ in range(5))
@@ -2196,8 +3944,284 @@ class PPMACHardwareWriteRead(object):
         }
 
 
+class PPMACTokenCache(object):
+    """
+    On-disk cache of the tokens of program listings, so that programs that have
+    not changed since a previous run are not lexed again. Entries are keyed by a
+    hash of the listing, the data structure catalog it is lexed against and the
+    lexer version. Entries not used for maxAge seconds are evicted, as are the
+    least recently used ones while the cache is larger than maxBytes.
+    """
+
+    def __init__(self, cacheDir, maxBytes=64 * 1024 * 1024, maxAge=90 * 24 * 3600):
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self.maxAge = maxAge
+
+    @staticmethod
+    def getCatalogKey(catalog):
+        return hashlib.sha256("\n".join(sorted(catalog)).encode()).hexdigest()
+
+    def getCacheFile(self, listing, catalogKey):
+        key = hashlib.sha256(
+            f"{PPMACLexer.version}\n{catalogKey}\n{listing}".encode()
+        ).hexdigest()
+        return f"{self.cacheDir}/{key}.npz"
+
+    def read(self, listing, catalogKey):
+        """
+        Read the cached tokens of a program listing.
+        :param listing: Text of the listing.
+        :param catalogKey: Key of the data structure catalog, from getCatalogKey.
+        :return: Packed tokens, see PPMACLexer.packTokens, or None if there are
+        none cached.
+        """
+        cacheFile = self.getCacheFile(listing, catalogKey)
+        if not fileExists(cacheFile):
+            return None
+        try:
+            with np.load(cacheFile, allow_pickle=False) as cache:
+                if int(cache["version"]) != PPMACLexer.version:
+                    return None
+                typeCodes = cache["typeCodes"].tobytes()
+                values = cache["values"].tobytes().decode("utf-8")
+            # Keep track of when it was last used, for eviction
+            os.utime(cacheFile)
+        except (IOError, ValueError, KeyError) as e:
+            logging.info(f"Ignoring unreadable token cache {cacheFile}: {e}")
+            return None
+        return typeCodes, values
+
+    def write(self, listing, catalogKey, packed):
+        """
+        Cache the tokens of a program listing.
+        :param listing: Text of the listing.
+        :param catalogKey: Key of the data structure catalog, from getCatalogKey.
+        :param packed: Packed tokens, see PPMACLexer.packTokens.
+        :return:
+        """
+        typeCodes, values = packed
+        if values.count("\x00") != max(len(typeCodes) - 1, 0):
+            # A token contains a null character, so they can not be unpacked
+            return
+        cacheFile = self.getCacheFile(listing, catalogKey)
+        try:
+            os.makedirs(self.cacheDir, exist_ok=True)
+            with open(f"{cacheFile}.tmp", "wb") as writeFile:
+                np.savez(
+                    writeFile,
+                    version=PPMACLexer.version,
+                    typeCodes=np.frombuffer(typeCodes, np.uint8),
+                    values=np.frombuffer(values.encode("utf-8"), np.uint8),
+                )
+            os.replace(f"{cacheFile}.tmp", cacheFile)
+        except IOError as e:
+            logging.info(f"Could not write token cache {cacheFile}: {e}")
+
+    def evict(self):
+        """
+        Remove cached tokens that have not been used for maxAge seconds, then the
+        least recently used ones until the cache is no larger than maxBytes.
+        :return: Number of entries removed.
+        """
+        if not os.path.isdir(self.cacheDir):
+            return 0
+        entries = []
+        for entry in os.scandir(self.cacheDir):
+            if entry.is_file() and entry.name.endswith(".npz"):
+                fileStat = entry.stat()
+                entries.append((fileStat.st_mtime, fileStat.st_size, entry.path))
+        entries.sort(reverse=True)
+        oldest = time.time() - self.maxAge
+        totalSize, removed = 0, 0
+        for lastUsed, size, path in entries:
+            totalSize += size
+            if lastUsed >= oldest and totalSize <= self.maxBytes:
+                continue
+            try:
+                os.remove(path)
+                removed += 1
+            except IOError:
+                pass
+        if removed > 0:
+            logging.info(f"Evicted {removed} entries from token cache {self.cacheDir}.")
+        return removed
+
+
+class PPMACProgramCrossReference(object):
+    """
+    Index of the active elements and data structures referenced by each of the
+    programs of a ppmac, and of the programs referencing each active element and
+    data structure. References are found by lexing the program listings against
+    the data structures of the ppmac, so only elements with literal indices, e.g.
+    Motor[3].JogSpeed but not Motor[L0].JogSpeed, are found. Lines the lexer can
+    not handle, e.g. those using data structures with digits in their names such
+    as Gate3[], are searched for element names with elementPattern instead.
+    """
+
+    # Names made of substructures with at most one literal index each, e.g.
+    # gate3[0].chan[1].daca
+    elementPattern = re.compile(
+        "[a-z][a-z0-9]*(?:\\[[0-9]+\\])?(?:\\.[a-z][a-z0-9]*(?:\\[[0-9]+\\])?)*"
+    )
+
+    def __init__(self):
+        # Program name -> program type, e.g. Plc or Forward
+        self.programTypes = {}
+        self.elementsByProgram = {}
+        self.dataStructuresByProgram = {}
+        self.programsByElement = collections.defaultdict(set)
+        self.programsByDataStructure = collections.defaultdict(set)
+
+    def build(self, ppmac):
+        """
+        Index the references in all the programs of a ppmac.
+        :param ppmac: PowerPMAC instance read from the hardware, so that its data
+        structures are known.
+        :return:
+        """
+        catalog = ppmac.getDataStructureCatalog()
+        dataStructureNames = {name.lower(): name for name in ppmac.dataStructures}
+        for programs in ppmac.getAllPrograms():
+            for program in programs.values():
+                self.addProgram(program, catalog, dataStructureNames)
+        logging.info(
+            f"Cross-referenced {len(self.programsByElement)} active elements in "
+            f"{len(self.programTypes)} programs."
+        )
+
+    def addProgram(self, program, catalog, dataStructureNames):
+        """
+        Index the references in a program.
+        :param program: PowerPMAC._Program instance.
+        :param catalog: Data structure catalog the program is lexed against.
+        :param dataStructureNames: Dictionary mapping lower case data structure
+        names to their names in the symbols tables.
+        :return:
+        """
+        try:
+            tokens = program.tokens
+        except IOError as e:
+            # Lex what we can of the program, a line at a time
+            logging.info(f"Cross-referencing {program.name} line by line: {e}")
+            tokens = []
+            for line in program.listing:
+                try:
+                    tokens.extend(PPMACLexer(line, catalog, lowerCase=True).tokens)
+                except IOError:
+                    tokens.extend(
+                        ("symbol", name)
+                        for name in self.elementPattern.findall(line.lower())
+                    )
+        elements, dataStructures = set(), set()
+        for tokenType, value in tokens:
+            if tokenType != "symbol":
+                continue
+            dataStructure = dataStructureNames.get(
+                re.sub("\\[([0-9]+)\\]", "[]", value)
+            )
+            if dataStructure is None:
+                continue
+            # Give the element the same case as its data structure
+            indices = re.findall("\\[([0-9]*)\\]", value)
+            parts = dataStructure.split("[]")
+            elements.add(
+                parts[0]
+                + "".join(f"[{index}]{part}" for index, part in zip(indices, parts[1:]))
+            )
+            dataStructures.add(dataStructure)
+        self.programTypes[program.name] = program.type
+        self.elementsByProgram[program.name] = elements
+        self.dataStructuresByProgram[program.name] = dataStructures
+        for element in elements:
+            self.programsByElement[element].add(program.name)
+        for dataStructure in dataStructures:
+            self.programsByDataStructure[dataStructure].add(program.name)
+
+    def getPrograms(self, name, programType=None):
+        """
+        Get the programs referencing an active element or data structure.
+        :param name: Name of an active element, e.g. Motor[3].JogSpeed, or data
+        structure, e.g. Motor[].JogSpeed.
+        :param programType: If given, only return programs of this type, e.g. Plc.
+        :return: Sorted list of program names.
+        """
+        programs = self.programsByElement.get(name, set()).union(
+            self.programsByDataStructure.get(name, set())
+        )
+        return sorted(
+            program
+            for program in programs
+            if programType is None or self.programTypes[program] == programType
+        )
+
+    def getReferences(self, programName):
+        """
+        Get the active elements and data structures referenced by a program.
+        :param programName: Name of the program.
+        :return: Tuple of sorted lists of active element and data structure names.
+        """
+        return (
+            sorted(self.elementsByProgram.get(programName, ())),
+            sorted(self.dataStructuresByProgram.get(programName, ())),
+        )
+
+    def write(self, fileName):
+        index = {
+            "programs": {
+                program: {
+                    "type": programType,
+                    "elements": sorted(self.elementsByProgram[program]),
+                    "dataStructures": sorted(self.dataStructuresByProgram[program]),
+                }
+                for program, programType in sorted(self.programTypes.items())
+            },
+            "elements": {
+                element: sorted(programs)
+                for element, programs in sorted(self.programsByElement.items())
+            },
+            "dataStructures": {
+                dataStructure: sorted(programs)
+                for dataStructure, programs in sorted(
+                    self.programsByDataStructure.items()
+                )
+            },
+        }
+        with open(fileName, "w+") as writeFile:
+            json.dump(index, writeFile, indent=1)
+
+    def read(self, fileName):
+        with open(fileName, "r") as readFile:
+            index = json.load(readFile)
+        for program, info in index["programs"].items():
+            self.programTypes[program] = info["type"]
+            self.elementsByProgram[program] = set(info["elements"])
+            self.dataStructuresByProgram[program] = set(info["dataStructures"])
+        for element, programs in index["elements"].items():
+            self.programsByElement[element] = set(programs)
+        for dataStructure, programs in index["dataStructures"].items():
+            self.programsByDataStructure[dataStructure] = set(programs)
+
+
 class PowerPMAC:
     class DataStructure:
+        __slots__ = (
+            "name",
+            "base",
+            "field1",
+            "field2",
+            "field3",
+            "field4",
+            "field5",
+            "field6",
+            "field7",
+            "field8",
+            "field9",
+            "field10",
+            "field11",
+            "field12",
+        )
+
         def __init__(
             self,
             name="",
@@ -2215,20 +4239,22 @@ class PowerPMAC:
             field11="",
             field12="",
         ):
-            self.name = name
-            self.base = base
-            self.field1 = field1
-            self.field2 = field2
-            self.field3 = field3
-            self.field4 = field4
-            self.field5 = field5
-            self.field6 = field6
-            self.field7 = field7
-            self.field8 = field8
-            self.field9 = field9
-            self.field10 = field10
-            self.field11 = field11
-            self.field12 = field12
+            # Most fields of the symbols tables take only a few distinct values,
+            # so intern them rather than keeping a copy per data structure
+            self.name = sys.intern(name)
+            self.base = sys.intern(base)
+            self.field1 = sys.intern(field1)
+            self.field2 = sys.intern(field2)
+            self.field3 = sys.intern(field3)
+            self.field4 = sys.intern(field4)
+            self.field5 = sys.intern(field5)
+            self.field6 = sys.intern(field6)
+            self.field7 = sys.intern(field7)
+            self.field8 = sys.intern(field8)
+            self.field9 = sys.intern(field9)
+            self.field10 = sys.intern(field10)
+            self.field11 = sys.intern(field11)
+            self.field12 = sys.intern(field12)
 
         def printInfo(self):
             s = (
@@ -2263,28 +4289,177 @@ class PowerPMAC:
             return s
 
     class ActiveElement:
+        __slots__ = ("name", "value", "category", "dataStructure", "indices")
+
         def __init__(
             self, name="", value="", category="", dataStructure="", indices=[]
         ):
             self.name = name
             self.value = value
-            if dataStructure == "":
-                self.dataStructure = re.sub("\\[([0-9]+)\\]", "[]", self.name)
-            else:
-                self.dataStructure = dataStructure
-            if category == "":
-                if self.dataStructure.find(".") == -1:
-                    category = self.dataStructure
-                else:
-                    category = self.dataStructure[0 : self.dataStructure.find(".")]
-                self.category = category.replace("[]", "")
-            else:
-                self.category = category
+            self.category, self.dataStructure = PowerPMAC.getElementStructure(
+                name, category, dataStructure
+            )
             self.indices = indices
 
         def printInfo(self):
             return self.name + "  " + self.value
 
+    class ActiveElementView:
+        """
+        Read-only view of one active element held in an ActiveElementStore, with
+        the same attributes as ActiveElement.
+        """
+
+        __slots__ = ("store", "row")
+
+        def __init__(self, store, row):
+            self.store = store
+            self.row = row
+
+        @property
+        def name(self):
+            return self.store.names[self.row]
+
+        @property
+        def value(self):
+            return self.store.values[self.row]
+
+        @property
+        def dataStructure(self):
+            return self.store.structures[self.store.structureIds[self.row]][0]
+
+        @property
+        def category(self):
+            return self.store.structures[self.store.structureIds[self.row]][1]
+
+        @property
+        def indices(self):
+            count = self.store.indexCounts[self.row]
+            if count == self.store.noIndices:
+                return None
+            start = self.store.indexStarts[self.row]
+            return self.store.indexValues[start : start + count].tolist()
+
+        def printInfo(self):
+            return self.name + "  " + self.value
+
+    class ActiveElementStore(collections.abc.Mapping):
+        """
+        Dictionary-like store of the active elements of a ppmac, mapping element
+        names to ActiveElementView objects. The elements are held in columns, with
+        each distinct data structure/category pair stored once and referred to by
+        id and the indices of all the elements kept in one flat array, so that
+        several complete snapshots can be held in memory at once, e.g. when
+        comparing.
+        """
+
+        # Index count recorded for an element whose indices are None, e.g. an
+        # element of an un-indexed data structure
+        noIndices = 255
+
+        def __init__(self, elements=()):
+            """
+            :param elements: Iterable of tuples of the arguments of ActiveElement.
+            """
+            self.rows = {}
+            self.names = []
+            self.values = []
+            self.structureIds = array.array("I")
+            self.indexStarts = array.array("I")
+            self.indexCounts = array.array("B")
+            self.indexValues = array.array("l")
+            # Distinct (dataStructure, category) pairs, looked up by id
+            self.structures = []
+            self.structureIdsByKey = {}
+            for element in elements:
+                self.add(*element)
+
+        def add(self, name, value="", category="", dataStructure="", indices=()):
+            """
+            Add an active element to the store, replacing any existing element
+            with the same name.
+            :param name: Name of the active element, e.g. Motor[1].JogSpeed.
+            :param value: Value of the active element.
+            :param category: Category of the element, worked out from the name if
+            not given.
+            :param dataStructure: Data structure of the element, worked out from
+            the name if not given.
+            :param indices: Indices of the element in its data structure, or None.
+            :return:
+            """
+            if category == "" or dataStructure == "":
+                category, dataStructure = PowerPMAC.getElementStructure(
+                    name, category, dataStructure
+                )
+            structureKey = (dataStructure, category)
+            structureId = self.structureIdsByKey.get(structureKey)
+            if structureId is None:
+                structureId = len(self.structures)
+                self.structures.append(structureKey)
+                self.structureIdsByKey[structureKey] = structureId
+            indexStart = len(self.indexValues)
+            if indices is None:
+                indexCount = self.noIndices
+            else:
+                self.indexValues.extend(int(index) for index in indices)
+                indexCount = len(self.indexValues) - indexStart
+            row = self.rows.get(name)
+            if row is not None:
+                # The indices of the replaced element are left unused in the array
+                self.values[row] = value
+                self.structureIds[row] = structureId
+                self.indexStarts[row] = indexStart
+                self.indexCounts[row] = indexCount
+                return
+            self.rows[name] = len(self.names)
+            self.names.append(name)
+            self.values.append(value)
+            self.structureIds.append(structureId)
+            self.indexStarts.append(indexStart)
+            self.indexCounts.append(indexCount)
+
+        def __setitem__(self, name, element):
+            self.add(
+                name,
+                element.value,
+                element.category,
+                element.dataStructure,
+                element.indices,
+            )
+
+        def __getitem__(self, name):
+            return PowerPMAC.ActiveElementView(self, self.rows[name])
+
+        def __contains__(self, name):
+            return name in self.rows
+
+        def __iter__(self):
+            return iter(self.rows)
+
+        def __len__(self):
+            return len(self.rows)
+
+    @staticmethod
+    def getElementStructure(name, category="", dataStructure=""):
+        """
+        Work out the category and data structure of an active element if they have
+        not been given, e.g. Motor and Motor[].JogSpeed for Motor[1].JogSpeed.
+        :param name: Name of the active element.
+        :param category: Category of the element, or "" to derive it.
+        :param dataStructure: Data structure of the element, or "" to derive it
+        from the name.
+        :return: Tuple of the interned category and data structure.
+        """
+        if dataStructure == "":
+            dataStructure = re.sub("\\[([0-9]+)\\]", "[]", name)
+        if category == "":
+            if dataStructure.find(".") == -1:
+                category = dataStructure
+            else:
+                category = dataStructure[0 : dataStructure.find(".")]
+            category = category.replace("[]", "")
+        return sys.intern(category), sys.intern(dataStructure)
+
     class CoordSystemDefinition:
         def __init__(self, csNumber=None, definitions=[], forward=None, inverse=None):
             self.csNumber = csNumber  # coordinate system number
@@ -2323,10 +4498,34 @@ class PowerPMAC:
             self.offset = offset
             self.type = type
             self.listing = listing
-            self.dataStructureNames = set(ppmac.dataStructures.keys())
-            # Currently dataStructures are not read from the repository
-            # self.lexer = PPMACLexer('\n'.join(self.listing), self.dataStructureNames)
-            # self.tokens = self.lexer.tokens
+            self.ppmac = ppmac
+            self._lexer = None
+            # Tokens of the listing, lexed when first needed or by
+            # PowerPMAC.lexPrograms
+            self._tokens = None
+
+        @property
+        def dataStructureNames(self):
+            return self.ppmac.getDataStructureCatalog()
+
+        @property
+        def lexer(self):
+            """
+            Lexer of the program listing, only created the first time it is used.
+            Note that data structures are currently not read from the repository,
+            so for a ppmac read from a repository the lexer does not know them.
+            """
+            if self._lexer is None:
+                self._lexer = PPMACLexer(
+                    "".join(self.listing), self.dataStructureNames, lowerCase=True
+                )
+            return self._lexer
+
+        @property
+        def tokens(self):
+            if self._tokens is None:
+                self._tokens = self.lexer.tokens
+            return self._tokens
 
         def printInfo(self):
             s = (
@@ -2356,8 +4555,20 @@ class PowerPMAC:
         self.source = name
         # Dictionary mapping DS names to dataStructure objects
         self.dataStructures = {}
+        # Lower case names of the data structures, shared by all the programs and
+        # built from self.dataStructures when first needed
+        self.dataStructureCatalog = None
+        self.dataStructureCatalogSource = None
+        # PPMACProgramCrossReference, built or read when first needed
+        self.programCrossReference = None
+        # PPMACTokenCache used when lexing the programs, if any
+        self.tokenCache = None
+        # Total number of characters in the listings to lex above which
+        # lexPrograms uses a pool of processes. The lexer gets through roughly a
+        # megabyte a second, so smaller listings are lexed before the pool starts.
+        self.lexPoolThreshold = 100000
         # Dictionary of active elements
-        self.activeElements = {}
+        self.activeElements = PowerPMAC.ActiveElementStore()
         # Dictionary of programs
         self.motionPrograms = {}
         # Dictionary of sub-programs
@@ -2392,6 +4603,113 @@ class PowerPMAC:
         # GateIo[i] can have i = 0,..,15 (software reference manual p.360),
         # although i > 15 does not return an error
 
+    def getDataStructureCatalog(self):
+        """
+        Get the set of lower case data structure names used to lex the programs,
+        passed to PPMACLexer with lowerCase=True. It is built once and shared by all
+        the programs, and only rebuilt if self.dataStructures is replaced.
+        :return: frozenset of data structure names.
+        """
+        if self.dataStructureCatalogSource is not self.dataStructures:
+            self.dataStructureCatalog = frozenset(
+                name.lower() for name in self.dataStructures
+            )
+            self.dataStructureCatalogSource = self.dataStructures
+        return self.dataStructureCatalog
+
+    def getAllPrograms(self):
+        return [
+            self.motionPrograms,
+            self.subPrograms,
+            self.plcPrograms,
+            self.forwardPrograms,
+            self.inversePrograms,
+        ]
+
+    def lexPrograms(self, processes=None):
+        """
+        Lex the listings of all the programs that have not been lexed yet, using a
+        pool of processes if their total size is above self.lexPoolThreshold. The
+        listings are shared out and the tokens stored in the same order every
+        time, so the results do not depend on the number of processes. Programs
+        that can not be lexed are left to be lexed, and raise the error, when their
+        tokens are first used.
+        :param processes: Number of processes, defaults to the number of CPUs.
+        :return:
+        """
+        programs = [
+            program
+            for programsOfType in self.getAllPrograms()
+            for _, program in sorted(programsOfType.items())
+            if program._tokens is None
+        ]
+        catalog = self.getDataStructureCatalog()
+        if self.tokenCache is not None:
+            catalogKey = PPMACTokenCache.getCatalogKey(catalog)
+            uncached = []
+            for program in programs:
+                packed = self.tokenCache.read("".join(program.listing), catalogKey)
+                if packed is None:
+                    uncached.append(program)
+                else:
+                    program._tokens = PPMACLexer.unpackTokens(packed)
+            logging.info(
+                f"Read the tokens of {len(programs) - len(uncached)} programs from "
+                f"the token cache."
+            )
+            programs = uncached
+        processes = min(processes or os.cpu_count() or 1, len(programs))
+        listings = ["".join(program.listing) for program in programs]
+        # Number of programs whose listings have been through the pool
+        lexed = 0
+        if processes > 1 and sum(map(len, listings)) > self.lexPoolThreshold:
+            chunkSize = max(1, len(listings) // (4 * processes))
+            chunks = [
+                listings[n : n + chunkSize] for n in range(0, len(listings), chunkSize)
+            ]
+            try:
+                with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+                    catalogs = itertools.repeat(catalog)
+                    packedTokens = itertools.chain.from_iterable(
+                        executor.map(lexInLexerProcess, chunks, catalogs)
+                    )
+                    for program, packed in zip(programs, packedTokens):
+                        if packed is not None:
+                            program._tokens = PPMACLexer.unpackTokens(packed)
+                        lexed += 1
+                logging.info(f"Lexed {lexed} programs using {processes} processes.")
+            except Exception as e:
+                logging.warning(
+                    f"Unable to lex programs in a pool of processes, lexing the "
+                    f"remaining {len(programs) - lexed} in this process: {e}"
+                )
+        for program in programs[lexed:]:
+            try:
+                program.tokens
+            except IOError:
+                pass
+        if self.tokenCache is not None:
+            for program in programs:
+                if program._tokens is not None:
+                    self.tokenCache.write(
+                        "".join(program.listing),
+                        catalogKey,
+                        PPMACLexer.packTokens(program._tokens),
+                    )
+            self.tokenCache.evict()
+
+    def getProgramCrossReference(self):
+        """
+        Get the index of the active elements and data structures referenced by the
+        programs, building it the first time it is needed.
+        :return: PPMACProgramCrossReference
+        """
+        if self.programCrossReference is None:
+            self.lexPrograms()
+            self.programCrossReference = PPMACProgramCrossReference()
+            self.programCrossReference.build(self)
+        return self.programCrossReference
+
 
 class PPMACanalyse:
     def __init__(self, ppmacArgs):
@@ -2404,6 +4722,28 @@ class PPMACanalyse:
         self.backupDir = None
         self.username = None
         self.password = None
+        self.useRangeQueries = ppmacArgs.rangequeries
+        self.useExtentSearch = ppmacArgs.extentsearch
+        self.channels = 1
+        if ppmacArgs.channels is not None:
+            if ppmacArgs.channels[0] < 1:
+                raise IOError(
+                    f"Invalid number of channels {ppmacArgs.channels[0]}, should be "
+                    "at least 1."
+                )
+            self.channels = ppmacArgs.channels[0]
+        self.useControllerDump = ppmacArgs.controllerdump
+        self.planOnly = ppmacArgs.plan
+        self.adaptiveSnapshotDir = ppmacArgs.adaptive
+        self.resume = ppmacArgs.resume
+        self.streamActiveElements = ppmacArgs.stream
+        self.compareTokens = ppmacArgs.comparetokens
+        self.cacheDir = None
+        if ppmacArgs.cachedir is not None:
+            self.cacheDir = ppmacArgs.cachedir[0]
+        self.pipelineWindow = 0
+        if ppmacArgs.pipeline is not None:
+            self.pipelineWindow = ppmacArgs.pipeline[0]
         if ppmacArgs.interface is not None:
             if not isValidNetworkInterface(ppmacArgs.interface[0]):
                 raise IOError(
@@ -2435,6 +4775,26 @@ class PPMACanalyse:
         if ppmacArgs.download is not None:
             self.processDownloadOptions(ppmacArgs)
             self.download()
+        if ppmacArgs.buildsymbolcache is not None:
+            self.buildSymbolsTablesCaches(ppmacArgs.buildsymbolcache[0])
+
+    def buildSymbolsTablesCaches(self, databasesDir):
+        if not os.path.isdir(databasesDir):
+            raise IOError(f"Databases directory {databasesDir} does not exist.")
+        hardwareWriteRead = PPMACHardwareWriteRead(PowerPMAC())
+        cachedFiles = hardwareWriteRead.buildSymbolsTablesCaches(databasesDir)
+        logging.info(f"Built symbols table caches for {len(cachedFiles)} files.")
+
+    def getHardwareReadOptions(self):
+        return {
+            "channels": self.channels,
+            "username": None if self.username is None else self.username[0],
+            "password": None if self.password is None else self.password[0],
+            "pipelineWindow": self.pipelineWindow,
+            "useControllerDump": self.useControllerDump,
+            "cacheDir": self.cacheDir,
+            "resume": self.resume,
+        }
 
     def processCompareOptions(self, ppmacArgs):
         if len(ppmacArgs.compare) < 3:
@@ -2483,7 +4843,11 @@ class PPMACanalyse:
             # sshClient.connect()
             if type == "all" or type == "active":
                 hardwareWriteRead = PPMACHardwareWriteRead(
-                    ppmacA, f"{self.compareDir}/tmp/databaseA"
+                    ppmacA,
+                    f"{self.compareDir}/tmp/databaseA",
+                    useRangeQueries=self.useRangeQueries,
+                    useExtentSearch=self.useExtentSearch,
+                    **self.getHardwareReadOptions(),
                 )
                 hardwareWriteRead.readAndStoreActiveState(self.ignoreFile)
             if type == "all" or type == "project":
@@ -2505,6 +4869,7 @@ class PPMACanalyse:
                 )
                 repositoryWriteRead.readAndStoreActiveElements()
                 repositoryWriteRead.readAndStoreBufferedPrograms()
+                repositoryWriteRead.readAndStoreProgramCrossReference()
                 repositoryWriteRead.readAndStoreCSAxesDefinitions()
             if type == "all" or type == "project":
                 projectASaved = PPMACProject(
@@ -2521,7 +4886,11 @@ class PPMACanalyse:
             # sshClient.connect()
             if type == "all" or type == "active":
                 hardwareWriteRead = PPMACHardwareWriteRead(
-                    ppmacB, f"{self.compareDir}/tmp/databaseB"
+                    ppmacB,
+                    f"{self.compareDir}/tmp/databaseB",
+                    useRangeQueries=self.useRangeQueries,
+                    useExtentSearch=self.useExtentSearch,
+                    **self.getHardwareReadOptions(),
                 )
                 hardwareWriteRead.readAndStoreActiveState(self.ignoreFile)
             if type == "all" or type == "project":
@@ -2543,6 +4912,7 @@ class PPMACanalyse:
                 )
                 repositoryWriteRead.readAndStoreActiveElements()
                 repositoryWriteRead.readAndStoreBufferedPrograms()
+                repositoryWriteRead.readAndStoreProgramCrossReference()
                 repositoryWriteRead.readAndStoreCSAxesDefinitions()
             if type == "all" or type == "project":
                 projectBSaved = PPMACProject(
@@ -2552,7 +4922,9 @@ class PPMACanalyse:
                     "repository", f"{self.compareSourceB}/project/active"
                 )
         # Run comparison
-        ppmacComparison = PPMACCompare(ppmacA, ppmacB, self.compareDir)
+        ppmacComparison = PPMACCompare(
+            ppmacA, ppmacB, self.compareDir, compareTokens=self.compareTokens
+        )
         if type == "all" or type == "active":
             ppmacComparison.compareActiveElements()
             ppmacComparison.comparePrograms()
@@ -2592,13 +4964,38 @@ class PPMACanalyse:
         # Check that we can connect
         self.checkConnection(False)
         if type == "all" or type == "active":
+            previousSnapshotDir = None
+            if self.adaptiveSnapshotDir is not None:
+                previousSnapshotDir = self.adaptiveSnapshotDir or self.backupDir
+            streamFile = None
+            if self.streamActiveElements:
+                streamFile = f"{self.backupDir}/active/activeElements.txt"
             # read current state of ppmac and store in ppmacA object
-            hardwareWriteRead = PPMACHardwareWriteRead(ppmacA, f"{self.backupDir}/tmp")
+            hardwareWriteRead = PPMACHardwareWriteRead(
+                ppmacA,
+                f"{self.backupDir}/tmp",
+                useRangeQueries=self.useRangeQueries,
+                useExtentSearch=self.useExtentSearch,
+                previousSnapshotDir=previousSnapshotDir,
+                streamFile=streamFile,
+                **self.getHardwareReadOptions(),
+            )
+            if self.planOnly:
+                plan = hardwareWriteRead.planActiveState(
+                    self.ignoreFile, f"{self.backupDir}/readPlan.txt"
+                )
+                print(
+                    f"Estimated {plan.queries} queries to read active elements, "
+                    f"see {self.backupDir}/readPlan.txt"
+                )
+                return
             hardwareWriteRead.readAndStoreActiveState(self.ignoreFile)
             # write current state of ppmacA object to repository
             activeDir = self.backupDir
             repositoryWriteRead = PPMACRepositoryWriteRead(ppmacA, activeDir)
-            repositoryWriteRead.writeActiveState()
+            repositoryWriteRead.writeActiveState(
+                includeActiveElements=streamFile is None
+            )
         if type == "all" or type == "project":
             savedProjectDir = f"{self.backupDir}/project/saved"
             os.makedirs(savedProjectDir, exist_ok=True)
@@ -0,0 +1,78 @@
+import os
+
+from dls_powerpmacanalyse.dls_ppmacanalyse import PowerPMAC, PPMACRepositoryWriteRead
+
+ELEMENTS = [
+    ("Sys.Time", "1234", "Sys", "Sys.Time", None),
+    ("Motor[1].JogSpeed", "32", "Motor", "Motor[].JogSpeed", [1]),
+    ("Coord[2].Q[5]", "0.5", "Coord", "Coord[].Q[]", [2, 5]),
+    ("Sys.Name", "a b c d e", "Sys", "Sys.Name", None),
+]
+
+
+def test_elements_are_stored():
+    store = PowerPMAC.ActiveElementStore(ELEMENTS)
+    assert len(store) == len(ELEMENTS)
+    assert list(store) == [element[0] for element in ELEMENTS]
+    for name, value, category, dataStructure, indices in ELEMENTS:
+        element = store[name]
+        assert element.name == name
+        assert element.value == value
+        assert element.category == category
+        assert element.dataStructure == dataStructure
+        assert element.indices == indices
+    assert "Motor[2].JogSpeed" not in store
+
+
+def test_scalar_element_without_indices():
+    store = PowerPMAC.ActiveElementStore()
+    store.add("Sys.Time", "1", "Sys", "Sys.Time", None)
+    assert store["Sys.Time"].indices is None
+    store.add("Sys.CpuTemp", "45")
+    assert store["Sys.CpuTemp"].indices == []
+    assert store["Sys.CpuTemp"].category == "Sys"
+
+
+def test_structure_is_worked_out_from_name():
+    store = PowerPMAC.ActiveElementStore()
+    store.add("Gate3[0].Chan[1].DacA", "0", indices=[0, 1])
+    element = store["Gate3[0].Chan[1].DacA"]
+    assert element.category == "Gate3"
+    assert element.dataStructure == "Gate3[].Chan[].DacA"
+
+
+def test_element_is_replaced():
+    store = PowerPMAC.ActiveElementStore(ELEMENTS)
+    store["Motor[1].JogSpeed"] = PowerPMAC.ActiveElement(
+        "Motor[1].JogSpeed", "16", indices=[1]
+    )
+    store.add("Sys.Time", "5678", "Sys", "Sys.Time", None)
+    assert len(store) == len(ELEMENTS)
+    assert store["Motor[1].JogSpeed"].value == "16"
+    assert store["Motor[1].JogSpeed"].indices == [1]
+    assert store["Sys.Time"].value == "5678"
+    assert store["Sys.Time"].indices is None
+
+
+def test_structures_are_shared():
+    store = PowerPMAC.ActiveElementStore(
+        (f"Motor[{i}].JogSpeed", "0", "Motor", "Motor[].JogSpeed", [i])
+        for i in range(100)
+    )
+    assert len(store.structures) == 1
+    assert [store[f"Motor[{i}].JogSpeed"].indices for i in range(100)] == [
+        [i] for i in range(100)
+    ]
+
+
+def test_repository_round_trip(tmp_path):
+    ppmac = PowerPMAC()
+    ppmac.activeElements = PowerPMAC.ActiveElementStore(ELEMENTS)
+    os.makedirs(tmp_path / "active")
+    PPMACRepositoryWriteRead(ppmac, str(tmp_path)).writeActiveElements()
+    readPPMAC = PowerPMAC()
+    PPMACRepositoryWriteRead(readPPMAC, str(tmp_path)).readAndStoreActiveElements()
+    assert {
+        name: element.value for name, element in readPPMAC.activeElements.items()
+    } == {element[0]: element[1] for element in ELEMENTS}
+    assert readPPMAC.activeElements["Coord[2].Q[5]"].dataStructure == "Coord[].Q[]"
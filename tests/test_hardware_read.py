@@ -0,0 +1,297 @@
+import os
+import re
+
+import pytest
+
+from dls_powerpmacanalyse import dls_ppmacanalyse
+from dls_powerpmacanalyse.dls_ppmacanalyse import PowerPMAC, PPMACHardwareWriteRead
+
+# Number of instances of each index of the data structures of a simulated ppmac,
+# given the values of the outer indices
+EXTENTS = {
+    "Motor[].JogSpeed": lambda *outer: 20,
+    "Sys.P[]": lambda *outer: 700,
+    "Coord[].Q[]": lambda *outer: [4, 90][len(outer)],
+    "ECAT[].IO[].Data": lambda *outer: [3, 50][len(outer)],
+    "CompTable[].Data[][]": lambda *outer: [2, 5, 6][len(outer)],
+    "Gate3[].Chan[].DacA": lambda *outer: outer[0] + 1 if outer else 3,
+}
+SCALARS = {"Sys.Time": "1234", "Sys.CpuTemp": "45"}
+IGNORE = ["Sys.P[100:]", "ECAT[].IO[5:9]", "Coord[2]", "Motor[3]"]
+
+
+def isValid(dataStructure, indices):
+    extent = EXTENTS.get(dataStructure)
+    if extent is None or len(indices) != dataStructure.count("[]"):
+        return False
+    return all(index < extent(*indices[:dim]) for dim, index in enumerate(indices))
+
+
+def isIgnored(name):
+    # Elements left out of the read by IGNORE
+    if name.startswith(("Coord[2].", "Motor[3].")):
+        return True
+    match = re.fullmatch("ECAT\\[[0-9]+\\]\\.IO\\[([0-9]+)\\]\\.Data", name)
+    if match is not None and 5 <= int(match.group(1)) <= 9:
+        return True
+    match = re.fullmatch("Sys\\.P\\[([0-9]+)\\]", name)
+    return match is not None and int(match.group(1)) >= 100
+
+
+class FakeSshClient:
+    """
+    Stand-in for the gpascii session of a simulated ppmac. Like a ppmac, it answers
+    each query on a command line in turn and abandons the rest of the line once it
+    rejects a query.
+    """
+
+    def __init__(self, isValid=isValid):
+        self.isValid = isValid
+        self.commands = []
+
+    def query(self, element):
+        if element in SCALARS:
+            return SCALARS[element]
+        ds = re.sub("\\[([0-9]+)\\]", "[]", element)
+        indices = [int(i) for i in re.findall("\\[([0-9]+)\\]", element)]
+        if self.isValid(ds, indices):
+            return f"{sum(indices)}"
+        return None
+
+    def expand(self, query):
+        match = re.search("\\[([0-9]+)\\.\\.([0-9]+)\\]", query)
+        if match is None:
+            return [query]
+        return [
+            query[: match.start()] + f"[{i}]" + query[match.end() :]
+            for i in range(int(match.group(1)), int(match.group(2)) + 1)
+        ]
+
+    def sendCommand(self, command):
+        self.commands.append(command)
+        replies = []
+        for query in command.split(" "):
+            for element in self.expand(query):
+                reply = self.query(element)
+                if reply is None:
+                    replies.append(f"stdin:1:1: error #20: ILLEGAL CMD: {query}")
+                    return "\r".join(replies) + "\r", True
+                replies.append(reply)
+        return "\r".join(replies) + "\r", True
+
+
+class MultiLineSshClient(FakeSshClient):
+    # Answers Sys.Time with two lines
+    def query(self, element):
+        reply = super().query(element)
+        return "1234\r5678" if element == "Sys.Time" else reply
+
+
+def expectedElements():
+    expected = dict(SCALARS)
+    for ds, extent in EXTENTS.items():
+        indices = [()]
+        for _ in range(ds.count("[]")):
+            indices = [
+                (*outer, index) for outer in indices for index in range(extent(*outer))
+            ]
+        for elementIndices in indices:
+            name = ds.replace("[]", "[{}]").format(*elementIndices)
+            if not isIgnored(name):
+                expected[name] = f"{sum(elementIndices)}"
+    return expected
+
+
+@pytest.fixture
+def sshClient(monkeypatch):
+    sshClient = FakeSshClient()
+    monkeypatch.setattr(dls_ppmacanalyse, "sshClient", sshClient)
+    return sshClient
+
+
+@pytest.fixture
+def ignoreFile(tmp_path):
+    ignoreFile = tmp_path / "ignore"
+    ignoreFile.write_text("\n".join(IGNORE) + "\n")
+    return str(ignoreFile)
+
+
+def readActiveElements(ignoreFile, **kwargs):
+    hardware = PPMACHardwareWriteRead(PowerPMAC(), **kwargs)
+    activeElements = hardware.getActiveElementsFromDataStructures(
+        [*SCALARS, *EXTENTS], hardware.generateIgnoreSet(ignoreFile)
+    )
+    return {name: element[1] for name, element in activeElements.items()}
+
+
+def test_batch_replies_are_split_onto_queries(sshClient):
+    hardware = PPMACHardwareWriteRead(PowerPMAC(), batchSize=8)
+    cmds = [f"Motor[{i}].JogSpeed" for i in range(20)]
+    assert hardware.sendCommandBatch(cmds) == [str(i) for i in range(20)]
+    assert len(sshClient.commands) == 3
+
+
+def test_queries_after_an_illegal_one_are_re_sent(sshClient):
+    hardware = PPMACHardwareWriteRead(PowerPMAC(), batchSize=8)
+    cmds = ["Motor[1].JogSpeed", "Motor[30].JogSpeed", "Sys.Time", "Motor[2].JogSpeed"]
+    replies = hardware.sendCommandBatch(cmds)
+    assert len(replies) == 4
+    assert replies[0] == "1"
+    assert "ILLEGAL" in replies[1]
+    assert replies[2:] == ["1234", "2"]
+    assert sshClient.commands == [" ".join(cmds), " ".join(cmds[2:])]
+
+
+def test_batch_stops_on_illegal(sshClient):
+    hardware = PPMACHardwareWriteRead(PowerPMAC(), batchSize=8)
+    cmds = ["Motor[1].JogSpeed", "Motor[30].JogSpeed", "Sys.Time"]
+    replies = hardware.sendCommandBatch(cmds, stopOnIllegal=True)
+    assert len(replies) == 2
+    assert "ILLEGAL" in replies[-1]
+    assert len(sshClient.commands) == 1
+
+
+def test_batch_with_too_many_replies_is_re_sent_query_by_query(monkeypatch, caplog):
+    sshClient = MultiLineSshClient()
+    monkeypatch.setattr(dls_ppmacanalyse, "sshClient", sshClient)
+    hardware = PPMACHardwareWriteRead(PowerPMAC(), batchSize=8)
+    cmds = ["Motor[1].JogSpeed", "Sys.Time", "Motor[2].JogSpeed"]
+    assert hardware.sendCommandBatch(cmds) == ["1", "1234", "2"]
+    assert sshClient.commands == [" ".join(cmds), *cmds]
+    assert "Re-sending its queries one at a time" in caplog.text
+
+
+def test_enabled_table_counts_do_not_bound_indices(monkeypatch):
+    sysValues = {"Sys.MaxMotors": "20", "Sys.CompEnable": "1", "Sys.CamEnable": "0"}
+    sshClient = FakeSshClient()
+    monkeypatch.setattr(sshClient, "query", sysValues.get)
+    monkeypatch.setattr(dls_ppmacanalyse, "sshClient", sshClient)
+    ppmac = PowerPMAC()
+    hardware = PPMACHardwareWriteRead(ppmac)
+    hardware.readSysMaxes()
+    assert hardware.getIndexBound("Motor[].JogSpeed", 1) == 20
+    assert hardware.getIndexBound("Coord[].Q[]", 1) is None
+    assert hardware.getIndexBound("CompTable[].Data[][]", 1) is None
+    assert (ppmac.numberOfCompTables, ppmac.numberOfCamTables) == (1, 0)
+
+
+def test_batches_fit_on_a_command_line():
+    hardware = PPMACHardwareWriteRead(PowerPMAC(), batchSize=1000)
+    cmds = [f"Gate3[{i}].Chan[{i}].DacA" for i in range(100)]
+    batch = hardware.nextBatch(cmds)
+    assert len(" ".join(batch)) <= hardware.maxCommandLength
+    assert len(" ".join(cmds[: len(batch) + 1])) > hardware.maxCommandLength
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {},
+        {"batchSize": 1},
+        {"useRangeQueries": True},
+        {"useExtentSearch": True},
+        {"useRangeQueries": True, "useExtentSearch": True},
+    ],
+)
+def test_active_elements_are_read(sshClient, ignoreFile, options):
+    assert readActiveElements(ignoreFile, **options) == expectedElements()
+
+
+def writeSnapshot(snapshotDir, elements):
+    os.makedirs(f"{snapshotDir}/active")
+    with open(f"{snapshotDir}/active/activeElements.txt", "w") as writeFile:
+        for name, value in elements.items():
+            writeFile.write(f"{name}  {value}\n")
+
+
+@pytest.mark.parametrize(
+    "change, gap", [(0, False), (1, False), (-1, False), (0, True)]
+)
+def test_active_elements_are_read_from_previous_snapshot(
+    monkeypatch, tmp_path, ignoreFile, change, gap
+):
+    # Previous snapshot of a ppmac with the same number of, one less or one more
+    # instance of each index, so that some outer indices had none, or with a gap
+    # in the runs of innermost indices at index 1
+    def previousIsValid(ds, indices):
+        extent = EXTENTS.get(ds)
+        if extent is None or len(indices) != ds.count("[]"):
+            return False
+        return all(
+            index < extent(*indices[:dim]) - change for dim, index in enumerate(indices)
+        )
+
+    monkeypatch.setattr(dls_ppmacanalyse, "sshClient", FakeSshClient(previousIsValid))
+    previous = readActiveElements(ignoreFile)
+    if gap:
+        previous = {
+            name: value
+            for name, value in previous.items()
+            if re.findall("\\[([0-9]+)\\]", name)[-1:] != ["1"]
+        }
+    writeSnapshot(tmp_path / "previous", previous)
+    monkeypatch.setattr(dls_ppmacanalyse, "sshClient", FakeSshClient())
+    activeElements = readActiveElements(
+        ignoreFile, previousSnapshotDir=str(tmp_path / "previous")
+    )
+    assert activeElements == expectedElements()
+
+
+def test_previous_snapshot_read_times_out(sshClient, tmp_path, ignoreFile):
+    writeSnapshot(tmp_path / "previous", expectedElements())
+    hardware = PPMACHardwareWriteRead(PowerPMAC(), batchSize=8)
+    hardware.previousIndices = hardware.readPreviousIndices(str(tmp_path / "previous"))
+    activeElements = {}
+    hardware.fillDataStructureIndicesAdaptive(
+        "Sys.P[]", activeElements, hardware.generateIgnoreSet(ignoreFile), timeout=0
+    )
+    assert list(activeElements) == [f"Sys.P[{i}]" for i in range(8)]
+    assert len(sshClient.commands) == 1
+
+
+def test_read_is_resumed_from_checkpoint(sshClient, monkeypatch, tmp_path, ignoreFile):
+    assert readActiveElements(ignoreFile, tempDir=str(tmp_path)) == expectedElements()
+    assert os.path.isfile(tmp_path / "activeElements.checkpoint")
+    resumeClient = FakeSshClient()
+    monkeypatch.setattr(dls_ppmacanalyse, "sshClient", resumeClient)
+    activeElements = readActiveElements(ignoreFile, tempDir=str(tmp_path), resume=True)
+    assert activeElements == expectedElements()
+    assert resumeClient.commands == []
+
+
+def test_active_elements_are_stored(sshClient, ignoreFile):
+    hardware = PPMACHardwareWriteRead(PowerPMAC())
+    activeElements = hardware.getActiveElementsFromDataStructures(
+        [*SCALARS, *EXTENTS], hardware.generateIgnoreSet(ignoreFile)
+    )
+    store = PowerPMAC.ActiveElementStore(activeElements.values())
+    assert {name: element.value for name, element in store.items()} == (
+        expectedElements()
+    )
+    assert store["Sys.Time"].indices is None
+    assert store["Coord[1].Q[2]"].indices == [1, 2]
+
+
+def test_range_queries_stop_at_the_last_index(sshClient, ignoreFile):
+    readActiveElements(ignoreFile, useRangeQueries=True)
+    ranges = [cmd for cmd in sshClient.commands if ".." in cmd]
+    assert len(ranges) > 0
+    assert not any("ILLEGAL" in FakeSshClient().sendCommand(cmd)[0] for cmd in ranges)
+
+
+@pytest.mark.parametrize(
+    "options", [{}, {"useExtentSearch": True}, {"useRangeQueries": True}]
+)
+def test_ignored_indices_rejected_by_ppmac_are_skipped(
+    monkeypatch, ignoreFile, options
+):
+    # ECAT[].IO[5:9] is in the ignore list because the ppmac rejects it
+    def isValidExceptIgnored(ds, indices):
+        return isValid(ds, indices) and not (
+            ds == "ECAT[].IO[].Data" and 5 <= indices[1] <= 9
+        )
+
+    monkeypatch.setattr(
+        dls_ppmacanalyse, "sshClient", FakeSshClient(isValidExceptIgnored)
+    )
+    assert readActiveElements(ignoreFile, **options) == expectedElements()
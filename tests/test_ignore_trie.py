@@ -0,0 +1,111 @@
+import os
+import random
+import re
+
+import pytest
+
+import dls_powerpmacanalyse
+from dls_powerpmacanalyse.dls_ppmacanalyse import (
+    PowerPMAC,
+    PPMACHardwareWriteRead,
+    PPMACIgnoreTrie,
+)
+
+IGNORE_FILE = os.path.join(
+    os.path.dirname(dls_powerpmacanalyse.__file__), "ignore/ignore"
+)
+
+
+@pytest.fixture(scope="module")
+def hardware():
+    return PPMACHardwareWriteRead(PowerPMAC())
+
+
+@pytest.fixture(scope="module")
+def ignoreTrie(hardware):
+    return hardware.generateIgnoreSet(IGNORE_FILE)
+
+
+@pytest.fixture(scope="module")
+def expandedIgnoreSet(hardware, ignoreTrie):
+    # Set of data structures with each spliced range expanded into one name per
+    # index, as used before the ignore file was compiled into a trie
+    return {
+        expanded
+        for dataStructure in ignoreTrie
+        for expanded in hardware.expandSplicedIndices(dataStructure)
+    }
+
+
+def generateProbes(dataStructures, probesPerDataStructure=30, seed=0):
+    """
+    Generate data structure names near to those in the ignore file, by replacing
+    their indices with other values, unfilled, open-ended or spliced indices, and
+    adding or removing substructures.
+    """
+    rng = random.Random(seed)
+    values = [0, 1, 2, 5, 7, 8, 9, 10, 31, 32, 99, 100, 4095, 4096, 8192, 65536]
+    probes = set()
+    for dataStructure in dataStructures:
+        parts = re.split("(\\[[^\\]]*\\])", dataStructure)
+        for _ in range(probesPerDataStructure):
+            probe = "".join(
+                (
+                    rng.choice(["[]", f"[{k}]", f"[{k}:]", part])
+                    if part.startswith("[")
+                    else part
+                )
+                for part, k in zip(parts, (rng.choice(values) for _ in parts))
+            )
+            if rng.random() < 0.5:
+                probe += rng.choice([".A", ".B.C", ".Status[0]", ".Ldata"])
+            if rng.random() < 0.2 and "." in probe:
+                probe = probe[: probe.rfind(".")]
+            probes.add(probe)
+    return sorted(probes)
+
+
+def test_trie_holds_ignore_file(ignoreTrie):
+    assert "Sys.P[65536:]" in ignoreTrie
+    assert "ECAT[].IO[1:4095]" in list(ignoreTrie)
+    assert len(ignoreTrie) == len(list(ignoreTrie))
+
+
+def test_trie_matches_expanded_set(hardware, ignoreTrie, expandedIgnoreSet):
+    probes = generateProbes(list(ignoreTrie))
+    assert len(probes) > 10000
+    mismatches = [
+        probe
+        for probe in probes
+        if hardware.ignoreDataStructure(probe, ignoreTrie)
+        != hardware.ignoreDataStructure(probe, expandedIgnoreSet)
+        or (probe in ignoreTrie) != (probe in expandedIgnoreSet)
+    ]
+    assert mismatches == []
+    assert any(hardware.ignoreDataStructure(probe, ignoreTrie) for probe in probes)
+
+
+@pytest.mark.parametrize(
+    "dataStructure, ignored",
+    [
+        # Open-ended ranges only match the same text, the enumerator looking
+        # for them as Coord[8:] when it reaches index 8
+        ("Coord[8]", False),
+        ("Coord[8:]", True),
+        ("Coord[8:].Q[1]", True),
+        ("Coord[3].Q[8192:]", False),
+        ("Coord[].Q[8192:]", True),
+        ("ECAT[].IO[1]", True),
+        ("ECAT[].IO[4095].Data", True),
+        ("ECAT[].IO[4096]", False),
+        ("ECAT[].IO[01]", False),
+    ],
+)
+def test_spliced_and_open_ended_ranges(hardware, dataStructure, ignored):
+    ignore = PPMACIgnoreTrie(["Coord[8:]", "Coord[].Q[8192:]", "ECAT[].IO[1:4095]"])
+    assert hardware.ignoreDataStructure(dataStructure, ignore) == ignored
+
+
+def test_too_many_spliced_indices():
+    with pytest.raises(IOError):
+        PPMACIgnoreTrie(["CompTable[0:3].Data[0:3]"])
@@ -0,0 +1,180 @@
+import concurrent.futures
+
+import pytest
+
+from dls_powerpmacanalyse.dls_ppmacanalyse import PowerPMAC, PPMACLexer
+
+CATALOG = {"Motor[].JogSpeed", "Coord[].Q[]", "Sys.P[]"}
+
+
+@pytest.mark.parametrize(
+    "chars, tokens",
+    [
+        (
+            "Motor[1].JogSpeed=10.5",
+            [("symbol", "motor[1].jogspeed"), ("", "="), ("number", "10.5")],
+        ),
+        (
+            "Motor[12].JogSpeedX",
+            [("symbol", "motor[12].jogspeed"), ("symbol", "x")],
+        ),
+        ("Coord[1].Q[20]", [("symbol", "coord[1].q[20]")]),
+        (
+            "#1j=0",
+            [("", "#"), ("number", "1"), ("symbol", "j"), ("", "="), ("number", "0")],
+        ),
+        ('cmd "#1j+"', [("symbol", "cmd"), ("string", "#1j+")]),
+        (
+            "P100 = -1.5e3",
+            [
+                ("symbol", "p"),
+                ("number", "100"),
+                ("", "="),
+                ("", "-"),
+                ("number", "1.5"),
+                ("symbol", "e"),
+                ("number", "3"),
+            ],
+        ),
+        (
+            "abs(P1)",
+            [
+                ("symbol", "abs"),
+                ("", "("),
+                ("symbol", "p"),
+                ("number", "1"),
+                ("", ")"),
+            ],
+        ),
+        # Operators are the longest token at the start of a run of operators
+        (
+            "if (P1==2 && P2!=3) P3=P4>=5",
+            [
+                ("symbol", "if"),
+                ("", "("),
+                ("symbol", "p"),
+                ("number", "1"),
+                ("", "=="),
+                ("number", "2"),
+                ("", "&&"),
+                ("symbol", "p"),
+                ("number", "2"),
+                ("", "!="),
+                ("number", "3"),
+                ("", ")"),
+                ("symbol", "p"),
+                ("number", "3"),
+                ("", "="),
+                ("symbol", "p"),
+                ("number", "4"),
+                ("", ">="),
+                ("number", "5"),
+            ],
+        ),
+        (
+            "while(P1<=2 || P2>3)",
+            [
+                ("symbol", "while"),
+                ("", "("),
+                ("symbol", "p"),
+                ("number", "1"),
+                ("", "<="),
+                ("number", "2"),
+                ("", "||"),
+                ("symbol", "p"),
+                ("number", "2"),
+                ("", ">"),
+                ("number", "3"),
+                ("", ")"),
+            ],
+        ),
+        (
+            "P1=P2<<3",
+            [
+                ("symbol", "p"),
+                ("number", "1"),
+                ("", "="),
+                ("symbol", "p"),
+                ("number", "2"),
+                ("", "<<"),
+                ("number", "3"),
+            ],
+        ),
+        # The few tokens ending in a digit
+        (
+            "frax2(X,Y)",
+            [
+                ("symbol", "frax2"),
+                ("", "("),
+                ("symbol", "x"),
+                ("", ","),
+                ("symbol", "y"),
+                ("", ")"),
+            ],
+        ),
+        ("frax(X)", [("symbol", "frax"), ("", "("), ("symbol", "x"), ("", ")")]),
+        ("frax21", [("symbol", "frax2"), ("number", "1")]),
+        ("nofrax2", [("symbol", "nofrax2")]),
+        ("frax2", [("symbol", "frax2")]),
+        ("P1 = 3.", [("symbol", "p"), ("number", "1"), ("", "="), ("number", "3.")]),
+    ],
+)
+def test_tokens(chars, tokens):
+    assert PPMACLexer(chars, CATALOG).tokens == tokens
+
+
+def test_lower_case_catalog():
+    catalog = frozenset(name.lower() for name in CATALOG)
+    listing = "Motor[1].JogSpeed=Coord[2].Q[3]"
+    tokens = [("symbol", "motor[1].jogspeed"), ("", "="), ("symbol", "coord[2].q[3]")]
+    assert PPMACLexer(listing, catalog, lowerCase=True).tokens == tokens
+    assert PPMACLexer(listing, frozenset(CATALOG)).tokens == tokens
+
+
+def test_packed_tokens():
+    listing = 'if (Motor[1].JogSpeed>=10.5) cmd "#1j+"'
+    tokens = PPMACLexer(listing, CATALOG).tokens
+    assert PPMACLexer.unpackTokens(PPMACLexer.packTokens(tokens)) == tokens
+
+
+def test_unterminated_string():
+    with pytest.raises(IOError):
+        PPMACLexer('cmd "#1j+')
+
+
+class FailingPool:
+    # Number of pools started
+    started = 0
+
+    def __init__(self, processes):
+        FailingPool.started += 1
+        raise OSError("no processes")
+
+
+def lexedPpmac(lexPoolThreshold):
+    ppmac = PowerPMAC()
+    ppmac.dataStructures = {name: None for name in CATALOG}
+    ppmac.lexPoolThreshold = lexPoolThreshold
+    for n in range(4):
+        listing = [f"Motor[{n}].JogSpeed={n}\n"]
+        ppmac.plcPrograms[f"plc{n}"] = ppmac.Program(f"plc{n}", 0, 0, "Plc", listing)
+    ppmac.lexPrograms(processes=2)
+    return ppmac
+
+
+@pytest.mark.parametrize("lexPoolThreshold, started", [(100000, 0), (0, 1)])
+def test_small_listings_are_lexed_in_process(
+    monkeypatch, caplog, lexPoolThreshold, started
+):
+    monkeypatch.setattr(FailingPool, "started", 0)
+    monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor", FailingPool)
+    ppmac = lexedPpmac(lexPoolThreshold)
+    assert ppmac.plcPrograms["plc3"]._tokens == [
+        ("symbol", "motor[3].jogspeed"),
+        ("", "="),
+        ("number", "3"),
+    ]
+    assert FailingPool.started == started
+    # Falling back to lexing in process is worth a warning
+    assert len(caplog.records) == started
+    assert all(record.levelname == "WARNING" for record in caplog.records)
@@ -0,0 +1,128 @@
+import select
+import socket
+
+import pytest
+
+from dls_powerpmacanalyse.dls_ppmacanalyse import (
+    PowerPMAC,
+    PPMACHardwareWriteRead,
+    PPMACPipelinedChannel,
+)
+
+
+class FakeGpasciiChannel:
+    """
+    Stand-in for a paramiko channel running gpascii -2. Replies to each command are
+    written to one end of a socket pair so that the channel can be watched by the
+    asyncio event loop. Rejected commands are reported on stderr, which only reaches
+    the reader if stderr has been combined with stdout.
+    """
+
+    def __init__(self, values):
+        self.values = values
+        self.sock, self.peer = socket.socketpair()
+        self.combineStderr = False
+        self.stderr = b""
+        self.commands = []
+
+    def set_combine_stderr(self, combine):
+        self.combineStderr = combine
+
+    def exec_command(self, command):
+        assert command == "gpascii -2"
+        self.peer.sendall(b"STDIN Open for ASCII Input\r\n")
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def recv_ready(self):
+        return len(select.select([self.sock], [], [], 0)[0]) > 0
+
+    def recv(self, size):
+        return self.sock.recv(size)
+
+    def exit_status_ready(self):
+        return False
+
+    def sendall(self, data):
+        for cmd in data.decode(encoding="ISO-8859-1").splitlines():
+            self.commands.append(cmd)
+            if cmd in self.values:
+                self.peer.sendall(f"{self.values[cmd]}\r\n".encode())
+            elif cmd != "echo 7":
+                error = f"stdin:1:1: error #20: ILLEGAL CMD: {cmd}\r\n".encode()
+                if self.combineStderr:
+                    self.peer.sendall(error)
+                else:
+                    self.stderr += error
+            self.peer.sendall(b"\x06\r\n")
+
+    def close(self):
+        self.sock.close()
+        self.peer.close()
+
+
+class FakeSshInterface:
+    def __init__(self, channel):
+        self.channel = channel
+        self.client = self
+
+    def get_transport(self):
+        return self
+
+    def open_session(self):
+        return self.channel
+
+
+VALUES = {
+    "Motor[1].JogSpeed": "32",
+    "Motor[2].JogSpeed": "16",
+    "list plc1": "open plc 1\r\nP1=1\r\nclose",
+}
+
+
+@pytest.fixture
+def channel():
+    fake = FakeGpasciiChannel(VALUES)
+    channel = PPMACPipelinedChannel(FakeSshInterface(fake), window=2)
+    yield channel
+    channel.close()
+
+
+def test_replies_are_matched_to_commands(channel):
+    cmds = ["Motor[1].JogSpeed", "list plc1", "Motor[2].JogSpeed"]
+    assert channel.sendCommands(cmds) == [
+        ["32"],
+        ["open plc 1", "P1=1", "close"],
+        ["16"],
+    ]
+    assert channel.sendCommand("Motor[2].JogSpeed") == ["16"]
+
+
+def test_illegal_reply_is_received(channel):
+    assert channel.sendCommands(["Motor[1].JogSpeed", "Motor[3].JogSpeed"]) == [
+        ["32"],
+        ["stdin:1:1: error #20: ILLEGAL CMD: Motor[3].JogSpeed"],
+    ]
+    assert channel.channel.stderr == b""
+
+
+def test_command_batch_stops_on_illegal(channel):
+    hardware = PPMACHardwareWriteRead(PowerPMAC())
+    hardware.pipelinedChannel = channel
+    cmds = ["Motor[1].JogSpeed", "Motor[2].JogSpeed", "Motor[3].JogSpeed"]
+    replies = hardware.sendCommandBatch(cmds)
+    assert replies[:2] == ["32", "16"]
+    assert "ILLEGAL" in replies[2]
+    assert hardware.sendCommandBatch(cmds[::-1], stopOnIllegal=True) == [
+        "stdin:1:1: error #20: ILLEGAL CMD: Motor[3].JogSpeed"
+    ]
+
+
+def test_command_with_several_reply_lines_is_re_sent(channel, caplog):
+    hardware = PPMACHardwareWriteRead(PowerPMAC())
+    hardware.pipelinedChannel = channel
+    cmds = ["Motor[1].JogSpeed", "list plc1", "Motor[2].JogSpeed"]
+    assert hardware.sendCommandBatch(cmds) == ["32", "open plc 1", "16"]
+    assert channel.channel.commands[-1] == "list plc1"
+    assert "Re-sending it on its own" in caplog.text
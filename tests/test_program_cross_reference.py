@@ -0,0 +1,15 @@
+from dls_powerpmacanalyse.dls_ppmacanalyse import PowerPMAC, PPMACProgramCrossReference
+
+
+def test_references_in_lines_the_lexer_can_not_handle_are_found():
+    ppmac = PowerPMAC()
+    ppmac.dataStructures = {"Gate3[].Chan[].DacA": None, "Motor[].JogSpeed": None}
+    listing = ["Gate3[0].Chan[1].DacA=Motor[1].JogSpeed\n", "P1=Motor[2].JogSpeed\n"]
+    ppmac.plcPrograms["plc1"] = ppmac.Program("plc1", 0, 0, "Plc", listing)
+    crossReference = PPMACProgramCrossReference()
+    crossReference.build(ppmac)
+    assert crossReference.getReferences("plc1") == (
+        ["Gate3[0].Chan[1].DacA", "Motor[1].JogSpeed", "Motor[2].JogSpeed"],
+        ["Gate3[].Chan[].DacA", "Motor[].JogSpeed"],
+    )
+    assert crossReference.programsByElement["Gate3[0].Chan[1].DacA"] == {"plc1"}